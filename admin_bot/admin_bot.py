@@ -1,27 +1,41 @@
 # admin_bot/bot.py
 import inspect
 import asyncio
+import logging
 import os
 import shutil
+import tempfile
+import time
 import uuid
 from html import escape
-from typing import Optional
+from typing import List, Optional
 
-from aiogram import Bot, Dispatcher, F
+from aiogram import Dispatcher, F
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
-from aiogram.types import Message, CallbackQuery, BotCommand, MenuButtonCommands
-from aiogram.client.default import DefaultBotProperties
+from aiogram.types import Message, CallbackQuery, BotCommand, MenuButtonCommands, FSInputFile, InputMediaPhoto, PhotoSize
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import delete, select, update, func
+from sqlalchemy.orm import joinedload
 
 from config import settings
-from server.db import SessionLocal, engine, Base
-from server.models import Product, ProductImage
-
+from server.broadcast import PHOTOS_DIR, BroadcastWorker, cancel_active, count_recipients, markup as broadcast_markup
+from server.catalog import stamp_changes
+from server.db import SessionLocal, engine
+from server.exporter import FORMATS as EXPORT_FORMATS, export_catalog
+from server import media
+from server.images import remove_variants
+from server.importer import ImportFormatError, import_file
+from server.migrations import migrate
+from server.models import Broadcast, MediaBlob, Product, ProductImage
+from server.search import apply_search
+from server.telegram import create_bot
+
+log = logging.getLogger(__name__)
 
 ADMIN_IDS = set(settings.ADMIN_IDS)
 
@@ -68,6 +82,8 @@ def main_menu_kb():
     kb.button(text="🔍 Посмотреть", callback_data="menu_view")
     kb.button(text="🖼 Добавить фото", callback_data="menu_addphoto")
     kb.button(text="🗑 Удалить", callback_data="menu_del")
+    kb.button(text="📥 Импорт прайса", callback_data="menu_import")
+    kb.button(text="📣 Рассылка", callback_data="menu_broadcast")
     if getattr(settings, "WEBAPP_URL", None):
         kb.button(text="🏪 Открыть магазин", url=settings.WEBAPP_URL)
     kb.adjust(1)
@@ -113,6 +129,18 @@ class NewProduct(StatesGroup):
     photos = State()
 
 
+class ImportState(StatesGroup):
+    file = State()
+
+
+class BroadcastState(StatesGroup):
+    content = State()
+
+
+class ListFilter(StatesGroup):
+    query = State()
+
+
 class AwaitID(StatesGroup):
     view_id = State()
     del_id = State()
@@ -120,7 +148,7 @@ class AwaitID(StatesGroup):
 
 
 # ---------- Bot / Dispatcher ----------
-bot = Bot(settings.ADMIN_BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+bot = create_bot(settings.ADMIN_BOT_TOKEN)
 dp = Dispatcher()
 
 
@@ -129,14 +157,170 @@ def product_dir(pid: int) -> str:
     return os.path.join(settings.MEDIA_ROOT, "products", str(pid))
 
 
-async def add_image_record(s: AsyncSession, pid: int, relpath: str, order: int) -> ProductImage:
-    img = ProductImage(product_id=pid, path=relpath, sort_order=order)
+async def touch_product(s: AsyncSession, pid: int):
+    """Сдвигаем updated_at товара и метим его счётчиком изменений — по ним сервер понимает,
+    что каталог изменился. Зовётся последним перед коммитом."""
+    await s.execute(update(Product).where(Product.id == pid).values(updated_at=func.now()))
+    await stamp_changes(s, [pid])
+
+
+async def add_image_record(
+    s: AsyncSession,
+    pid: int,
+    relpath: str,
+    order: int,
+    file_id: Optional[str] = None,
+    blob_hash: Optional[str] = None,
+) -> ProductImage:
+    img = ProductImage(product_id=pid, path=relpath, sort_order=order, file_id=file_id, blob_hash=blob_hash)
     s.add(img)
+    await touch_product(s, pid)
     await s.commit()
     await s.refresh(img)
     return img
 
 
+async def store_photo(ph: PhotoSize, pid: int, order: int) -> MediaBlob:
+    """Скачивает фото из Telegram и записывает его за товаром. Скачивание и превью — до
+    транзакции: на SQLite она держала бы блокировку записи всё это время."""
+    tmp = media.tmp_path(".jpg")
+    relpath = None
+    try:
+        await bot.download(ph, destination=tmp)
+        # превью — до записи в БД, чтобы сервер увидел товар сразу с ними
+        digest, relpath, size = await media.put_file(tmp, ".jpg")
+        async with SessionLocal() as s:
+            blob = await media.acquire(s, digest, relpath, size, file_unique_id=ph.file_unique_id)
+            await media.settle(tmp, blob)
+            await add_image_record(s, pid, blob.path, order, file_id=ph.file_id, blob_hash=blob.sha256)
+        return blob
+    except BaseException:
+        if relpath is not None:
+            await media.collect([relpath])  # файл, выложенный put_file(), без ссылки не нужен
+        raise
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+async def release_image(s: AsyncSession, img: ProductImage) -> Optional[str]:
+    """Отпускает файл фото: blob — по счётчику ссылок, старый файл товара — сразу.
+    Возвращает путь, который нужно передать в unlink_media() после коммита (или None)."""
+    if img.blob_hash:
+        return await media.release(s, img.blob_hash)
+    return img.path
+
+
+async def unlink_media(relpath: Optional[str]):
+    if not relpath:
+        return
+    if relpath.startswith(media.BLOBS_DIR + "/"):
+        await media.collect([relpath])  # сотрёт, только если ссылку никто не взял заново
+        return
+    abs_path = os.path.join(settings.MEDIA_ROOT, relpath)
+    try:
+        os.remove(abs_path)
+    except FileNotFoundError:
+        pass
+    remove_variants(abs_path)
+
+
+async def delete_product(pid: int) -> bool:
+    """Удаляет товар и его фото; общие с другими товарами файлы остаются на месте."""
+    async with SessionLocal() as s:
+        obj = await s.get(Product, pid)
+        if not obj:
+            return False
+        images = (await s.execute(select(ProductImage).where(ProductImage.product_id == pid))).scalars().all()
+        freed = [await release_image(s, img) for img in images]
+        # фото удаляем явно: на SQLite без foreign_keys ON DELETE CASCADE не срабатывает
+        await s.execute(delete(ProductImage).where(ProductImage.product_id == pid))
+        await s.delete(obj)
+        # webapp держит каталог у себя и узнаёт об удалении из /api/products/changes
+        await stamp_changes(s, removed=[pid])
+        await s.commit()
+    for relpath in freed:
+        await unlink_media(relpath)
+    shutil.rmtree(product_dir(pid), ignore_errors=True)
+    return True
+
+
+async def load_product_card(pid: int) -> Optional[Product]:
+    """Товар вместе с фото одним запросом (JOIN) — после закрытия сессии ленивых загрузок нет."""
+    async with SessionLocal() as s:
+        res = await s.execute(
+            select(Product).options(joinedload(Product.images)).where(Product.id == pid)
+        )
+        return res.unique().scalar_one_or_none()
+
+
+def product_card_text(p: Product, pics) -> str:
+    return (
+        f"<b>#{p.id}</b> {escape(p.title or '')}\n"
+        f"{escape(p.subtitle or '')}\n{escape(p.status or '')}\n"
+        f"Цена: {p.price}₽\n"
+        f"Категория: {escape(get_category_text(p))}\n"
+        f"Фото: {[i.id for i in pics]}"
+    )
+
+
+def _card_photo(img: ProductImage, by_reference: bool):
+    return img.file_id if (by_reference and img.file_id) else FSInputFile(os.path.join(settings.MEDIA_ROOT, img.path))
+
+
+async def _send_card_chunk(chat_id: int, chunk, caption: Optional[str], by_reference: bool) -> List[Message]:
+    """Альбом — это 2..10 фото: одиночное (в том числе 11-е, 21-е…) уходит send_photo."""
+    if len(chunk) == 1:
+        return [await bot.send_photo(chat_id, photo=_card_photo(chunk[0], by_reference), caption=caption, parse_mode="HTML")]
+    media = [
+        InputMediaPhoto(media=_card_photo(img, by_reference), caption=caption if n == 0 else None, parse_mode="HTML")
+        for n, img in enumerate(chunk)
+    ]
+    return await bot.send_media_group(chat_id, media=media)
+
+
+async def send_product_card(m: Message, p: Product):
+    """Карточка альбомом: фото уходят по сохранённому file_id, а не байтами с диска.
+
+    Для фото без file_id (импорт, старые записи) файл загружается один раз,
+    а выданный Telegram file_id сохраняется в ProductImage."""
+    pics = sorted(p.images, key=lambda i: (i.sort_order, i.id))
+    text = product_card_text(p, pics)
+    pics = [
+        i for i in pics
+        if i.file_id or os.path.exists(os.path.join(settings.MEDIA_ROOT, i.path))
+    ]
+    if not pics:
+        await m.answer(text)
+        return
+
+    learned = {}
+    for start in range(0, len(pics), 10):  # в альбоме не больше 10 фото
+        chunk = pics[start:start + 10]
+        caption = text if start == 0 else None
+        try:
+            sent = await _send_card_chunk(m.chat.id, chunk, caption, by_reference=True)
+        except TelegramBadRequest:
+            # file_id мог протухнуть (другой токен бота и т.п.) — шлём файлы заново
+            chunk = [i for i in chunk if os.path.exists(os.path.join(settings.MEDIA_ROOT, i.path))]
+            if not chunk:
+                if caption:
+                    await m.answer(text)
+                continue
+            sent = await _send_card_chunk(m.chat.id, chunk, caption, by_reference=False)
+            for img in chunk:
+                img.file_id = None
+        for img, msg in zip(chunk, sent):
+            if not img.file_id and msg.photo:
+                learned[img.id] = msg.photo[-1].file_id
+
+    if learned:
+        async with SessionLocal() as s:
+            for img_id, file_id in learned.items():
+                await s.execute(update(ProductImage).where(ProductImage.id == img_id).values(file_id=file_id))
+            await s.commit()
+
+
 async def setup_bot_ui():
     cmds = [
         BotCommand(command="start", description="Открыть меню"),
@@ -147,6 +331,9 @@ async def setup_bot_ui():
         BotCommand(command="addphoto", description="Добавить фото: /addphoto id"),
         BotCommand(command="del", description="Удалить товар: /del id"),
         BotCommand(command="delphoto", description="Удалить фото: /delphoto pid image_id"),
+        BotCommand(command="import", description="Импорт прайса CSV/XLSX"),
+        BotCommand(command="export", description="Выгрузка каталога: /export csv|xlsx"),
+        BotCommand(command="broadcast", description="Рассылка: /broadcast [id товара|stop]"),
     ]
     await bot.set_my_commands(cmds)
     await bot.set_chat_menu_button(menu_button=MenuButtonCommands())
@@ -171,18 +358,10 @@ async def menu_cmd(m: Message):
 
 @dp.message(Command("list"))
 @admin_only
-async def list_(m: Message):
-    async with SessionLocal() as s:
-        res = await s.execute(select(Product).order_by(Product.id.desc()))
-        items = res.scalars().all()
-    if not items:
-        await m.answer("Пусто.", parse_mode=None)
-        return
-    lines = []
-    for p in items:
-        cat = get_category_text(p)
-        lines.append(f"#{p.id} — {p.title} — {p.price}₽ ({p.status}) [{cat}]")
-    await m.answer("\n".join(lines), parse_mode=None)
+async def list_(m: Message, state: FSMContext):
+    await state.update_data(lst={})
+    text, kb = await render_list_page({})
+    await m.answer(text, reply_markup=kb, parse_mode=None)
 
 
 @dp.message(Command("view"))
@@ -192,25 +371,11 @@ async def view_(m: Message):
     if len(parts) < 2 or not parts[1].isdigit():
         await m.answer("Использование: /view [id]", parse_mode=None)
         return
-    pid = int(parts[1])
-    async with SessionLocal() as s:
-        p = await s.get(Product, pid)
+    p = await load_product_card(int(parts[1]))
     if not p:
         await m.answer("Нет такого товара", parse_mode=None)
         return
-    pics = sorted(p.images, key=lambda i: (i.sort_order, i.id))
-    title = escape(p.title or "")
-    subtitle = escape(p.subtitle or "")
-    status = escape(p.status or "")
-    cat = escape(get_category_text(p))
-    msg = (
-        f"<b>#{p.id}</b> {title}\n"
-        f"{subtitle}\n{status}\n"
-        f"Цена: {p.price}₽\n"
-        f"Категория: {cat}\n"
-        f"Фото: {[i.id for i in pics]}"
-    )
-    await m.answer(msg)
+    await send_product_card(m, p)
 
 
 @dp.message(Command("del"))
@@ -221,14 +386,9 @@ async def del_(m: Message):
         await m.answer("Использование: /del [id]", parse_mode=None)
         return
     pid = int(parts[1])
-    async with SessionLocal() as s:
-        obj = await s.get(Product, pid)
-        if not obj:
-            await m.answer("Нет такого товара", parse_mode=None)
-            return
-        await s.delete(obj)
-        await s.commit()
-    shutil.rmtree(product_dir(pid), ignore_errors=True)
+    if not await delete_product(pid):
+        await m.answer("Нет такого товара", parse_mode=None)
+        return
     await m.answer(f"Удалено #{pid}", parse_mode=None)
 
 
@@ -319,12 +479,13 @@ async def create_product_and_go_photos(
             category=category_value,
         )
         s.add(p)
+        await s.flush()
+        await stamp_changes(s, [p.id])
         await s.commit()
         await s.refresh(p)
         pid = p.id
 
     await state.update_data(product_id=pid, order=0)
-    os.makedirs(product_dir(pid), exist_ok=True)
     await state.set_state(NewProduct.photos)
     cat_msg = picked_category or "—"
     await target_msg.answer(
@@ -348,20 +509,18 @@ async def add_photo_in_new(m: Message, state: FSMContext):
     pid = data["product_id"]
     order = int(data.get("order", 0))
 
-    dest_dir = product_dir(pid)
-    os.makedirs(dest_dir, exist_ok=True)
-    filename = f"{uuid.uuid4().hex}.jpg"
-    dest_path = os.path.join(dest_dir, filename)
-
     ph = m.photo[-1]
-    await bot.download(ph, destination=dest_path)
-
-    relpath = os.path.relpath(dest_path, settings.MEDIA_ROOT)
     async with SessionLocal() as s:
-        await add_image_record(s, pid, relpath, order)
+        # это фото уже есть в хранилище (переслали ещё раз) — не качаем вовсе;
+        # иначе сессия закрывается без коммита — скачивание не держит транзакцию
+        blob = await media.acquire_by_unique_id(s, ph.file_unique_id)
+        if blob is not None:
+            await add_image_record(s, pid, blob.path, order, file_id=ph.file_id, blob_hash=blob.sha256)
+    if blob is None:
+        blob = await store_photo(ph, pid, order)
 
     await state.update_data(order=order + 1)
-    await m.answer(f"Фото добавлено ({filename}). Ещё отправляйте или /done", parse_mode=None)
+    await m.answer(f"Фото добавлено ({blob.sha256[:12]}). Ещё отправляйте или /done", parse_mode=None)
 
 
 @dp.message(Command("addphoto"))
@@ -374,7 +533,6 @@ async def addphoto(m: Message, state: FSMContext):
     pid = int(parts[1])
     await state.set_state(NewProduct.photos)
     await state.update_data(product_id=pid, order=0)
-    os.makedirs(product_dir(pid), exist_ok=True)
     await m.answer(f"Ок. Жду фото для #{pid}. Завершение — /done", parse_mode=None)
 
 
@@ -392,16 +550,453 @@ async def delphoto(m: Message):
         if not img or img.product_id != pid:
             await m.answer("Нет такого фото", parse_mode=None)
             return
-        abs_path = os.path.join(settings.MEDIA_ROOT, img.path)
-        try:
-            os.remove(abs_path)
-        except FileNotFoundError:
-            pass
+        freed = await release_image(s, img)
         await s.delete(img)
+        await touch_product(s, pid)
         await s.commit()
+    await unlink_media(freed)
     await m.answer(f"Фото {img_id} удалено.", parse_mode=None)
 
 
+# ---------- список товаров: keyset-страницы и фильтры ----------
+LIST_PAGE_SIZE = 15
+
+
+def list_filter_caption(f: dict) -> str:
+    parts = []
+    if f.get("category") is not None:
+        parts.append(f"категория: {f['category'] or '—'}")
+    if f.get("status"):
+        parts.append(f"статус: {f['status']}")
+    if f.get("q"):
+        parts.append(f"поиск: «{f['q']}»")
+    return "; ".join(parts)
+
+
+def list_filtered(stmt, f: dict):
+    if f.get("category") is not None:
+        stmt = stmt.where(Product.category == f["category"])
+    if f.get("status"):
+        stmt = stmt.where(Product.status == f["status"])
+    if f.get("q"):
+        stmt, _ = apply_search(stmt, f["q"], engine.dialect.name)
+    return stmt
+
+
+async def render_list_page(f: dict, direction: str = "n", cursor: Optional[int] = None):
+    """Страница списка: "n" — товары с id < cursor (дальше), "p" — с id > cursor (назад)."""
+    stmt = list_filtered(
+        select(Product.id, Product.title, Product.price, Product.status, Product.category), f
+    )
+    if direction == "p" and cursor is not None:
+        stmt = stmt.where(Product.id > cursor).order_by(Product.id.asc())
+    else:
+        if cursor is not None:
+            stmt = stmt.where(Product.id < cursor)
+        stmt = stmt.order_by(Product.id.desc())
+
+    async with SessionLocal() as s:
+        rows = (await s.execute(stmt.limit(LIST_PAGE_SIZE + 1))).all()
+
+    more = len(rows) > LIST_PAGE_SIZE
+    rows = rows[:LIST_PAGE_SIZE]
+    if direction == "p" and cursor is not None:
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = cursor is not None, more
+
+    caption = list_filter_caption(f)
+    lines = [f"Товары ({caption}):" if caption else "Товары:"]
+    if not rows:
+        lines.append("Пусто.")
+    for r in rows:
+        cat = r.category if (r.category or "").strip() else "—"
+        title = r.title if len(r.title) <= 80 else r.title[:79] + "…"
+        lines.append(f"#{r.id} — {title} — {r.price}₽ ({r.status}) [{cat}]")
+
+    kb = InlineKeyboardBuilder()
+    nav = 0
+    if rows and has_prev:
+        kb.button(text="◀", callback_data=f"lst:p:{rows[0].id}")
+        nav += 1
+    if rows and has_next:
+        kb.button(text="▶", callback_data=f"lst:n:{rows[-1].id}")
+        nav += 1
+    kb.button(text="🔎 Фильтры", callback_data="lst:f")
+    if caption:
+        kb.button(text="✖ Сбросить", callback_data="lst:x")
+    kb.adjust(*([nav] if nav else []), 2)
+    return "\n".join(lines), kb.as_markup()
+
+
+async def edit_list_message(msg: Message, text: str, kb):
+    try:
+        await msg.edit_text(text, reply_markup=kb, parse_mode=None)
+    except TelegramBadRequest:
+        pass  # то же содержимое («message is not modified»)
+
+
+@dp.callback_query(F.data.startswith("lst:n:") | F.data.startswith("lst:p:"))
+@admin_only
+async def cb_list_page(cb: CallbackQuery, state: FSMContext):
+    await cb.answer()
+    _, direction, cursor = cb.data.split(":", 2)
+    f = (await state.get_data()).get("lst") or {}
+    text, kb = await render_list_page(f, direction, int(cursor))
+    await edit_list_message(cb.message, text, kb)
+
+
+@dp.callback_query(F.data == "lst:x")
+@admin_only
+async def cb_list_reset(cb: CallbackQuery, state: FSMContext):
+    await cb.answer()
+    await state.update_data(lst={})
+    text, kb = await render_list_page({})
+    await edit_list_message(cb.message, text, kb)
+
+
+@dp.callback_query(F.data == "lst:f")
+@admin_only
+async def cb_list_filters(cb: CallbackQuery, state: FSMContext):
+    await cb.answer()
+    async with SessionLocal() as s:
+        cats = (await s.execute(select(Product.category).distinct().order_by(Product.category))).scalars().all()
+        statuses = (await s.execute(select(Product.status).distinct().order_by(Product.status))).scalars().all()
+    cats = [c or "" for c in cats]
+    statuses = [st for st in statuses if st]
+    # индексы в callback_data (лимит 64 байта), сами значения — в FSM
+    await state.update_data(lst_cats=cats, lst_statuses=statuses)
+
+    kb = InlineKeyboardBuilder()
+    for i, c in enumerate(cats):
+        kb.button(text=f"📂 {c or '— Без категории'}", callback_data=f"lst:c:{i}")
+    for i, st in enumerate(statuses):
+        kb.button(text=f"🏷 {st}", callback_data=f"lst:s:{i}")
+    kb.button(text="🔤 Поиск по названию", callback_data="lst:q")
+    kb.button(text="← К списку", callback_data="lst:b")
+    kb.adjust(1)
+    await edit_list_message(cb.message, "Фильтр списка (действуют вместе):", kb.as_markup())
+
+
+@dp.callback_query(F.data.startswith("lst:c:") | F.data.startswith("lst:s:"))
+@admin_only
+async def cb_list_pick(cb: CallbackQuery, state: FSMContext):
+    await cb.answer()
+    _, kind, idx = cb.data.split(":", 2)
+    data = await state.get_data()
+    f = dict(data.get("lst") or {})
+    values = data.get("lst_cats" if kind == "c" else "lst_statuses") or []
+    try:
+        f["category" if kind == "c" else "status"] = values[int(idx)]
+    except (IndexError, ValueError):
+        return
+    await state.update_data(lst=f)
+    text, kb = await render_list_page(f)
+    await edit_list_message(cb.message, text, kb)
+
+
+@dp.callback_query(F.data == "lst:b")
+@admin_only
+async def cb_list_back(cb: CallbackQuery, state: FSMContext):
+    await cb.answer()
+    text, kb = await render_list_page((await state.get_data()).get("lst") or {})
+    await edit_list_message(cb.message, text, kb)
+
+
+@dp.callback_query(F.data == "lst:q")
+@admin_only
+async def cb_list_query(cb: CallbackQuery, state: FSMContext):
+    await cb.answer()
+    await state.set_state(ListFilter.query)
+    await cb.message.answer("Что ищем в названии?", parse_mode=None, reply_markup=cancel_menu_kb())
+
+
+@dp.message(ListFilter.query)
+@admin_only
+async def list_query_flow(m: Message, state: FSMContext):
+    f = dict((await state.get_data()).get("lst") or {})
+    f["q"] = (m.text or "").strip()[:100]
+    await state.set_state(None)
+    await state.update_data(lst=f)
+    text, kb = await render_list_page(f)
+    await m.answer(text, reply_markup=kb, parse_mode=None)
+
+
+# ---------- импорт прайса ----------
+IMPORT_HELP = (
+    "Пришлите прайс документом: CSV (разделитель ; или ,) или XLSX, первая строка — заголовки.\n"
+    "Обязательные колонки: артикул (sku) или id, название (title), цена (price).\n"
+    "Необязательные: описание, статус, категория, активен, фото — ссылки на картинки или zip через пробел.\n"
+    "Строки с id (файл из /export) обновляют этот товар, остальные — товар с тем же артикулом;\n"
+    "фото качаются только для товаров без фото."
+)
+IMPORT_MAX_BYTES = 20 * 1024 * 1024  # больше Bot API ботам не отдаёт
+PROGRESS_EVERY = 2.0  # сек между правками сообщения о прогрессе
+
+
+async def edit_quiet(msg: Message, text: str):
+    try:
+        await msg.edit_text(text, parse_mode=None)
+    except TelegramBadRequest:
+        pass  # «message is not modified» и т.п.
+
+
+async def run_import(m: Message):
+    doc = m.document
+    ext = os.path.splitext(doc.file_name or "")[1].lower()
+    if ext not in (".csv", ".xlsx", ".xlsm"):
+        await m.answer("Нужен файл .csv или .xlsx", parse_mode=None)
+        return
+    if doc.file_size and doc.file_size > IMPORT_MAX_BYTES:
+        await m.answer("Файл больше 20 МБ — разбейте прайс на части.", parse_mode=None)
+        return
+
+    progress = await m.answer("📥 Импорт: скачиваю файл…", parse_mode=None)
+    last = 0.0
+
+    async def on_progress(st):
+        nonlocal last
+        if time.monotonic() - last < PROGRESS_EVERY:
+            return
+        last = time.monotonic()
+        await edit_quiet(progress, f"📥 Импорт: строк {st.rows}, новых {st.created}, обновлено {st.updated}, фото {st.images}…")
+
+    started = time.monotonic()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"import{ext}")
+        await bot.download(doc, destination=path)
+        try:
+            st = await import_file(path, on_progress=on_progress)
+        except ImportFormatError as e:
+            await edit_quiet(progress, f"Импорт не выполнен: {e}\n\n{IMPORT_HELP}")
+            return
+        except Exception as e:
+            # битый файл, кодировка, ошибка БД — пачки до сбоя уже закоммичены
+            log.exception("import of %s failed", doc.file_name)
+            await edit_quiet(
+                progress,
+                f"Импорт прервался: {type(e).__name__}: {e}\n"
+                "Строки до сбоя сохранены — исправьте файл и загрузите его снова.",
+            )
+            return
+
+    lines = [
+        f"✅ Импорт завершён за {time.monotonic() - started:.1f} с",
+        f"Строк: {st.rows}, новых товаров: {st.created}, обновлено: {st.updated}, пропущено: {st.skipped}",
+        f"Фото: {st.images}" + (f", не скачалось у {st.image_errors} товаров" if st.image_errors else ""),
+    ]
+    if st.errors:
+        lines += ["", "Ошибки (первые):"] + st.errors
+    await edit_quiet(progress, "\n".join(lines))
+
+
+@dp.message(Command("import"), F.document)
+@admin_only
+async def import_with_file(m: Message, state: FSMContext):
+    await state.clear()
+    await run_import(m)
+
+
+@dp.message(Command("import"))
+@admin_only
+async def import_(m: Message, state: FSMContext):
+    await state.set_state(ImportState.file)
+    await m.answer(IMPORT_HELP, parse_mode=None, reply_markup=cancel_menu_kb())
+
+
+@dp.message(ImportState.file, F.document)
+@admin_only
+async def import_file_flow(m: Message, state: FSMContext):
+    await state.clear()
+    await run_import(m)
+    await m.answer("Готово.", parse_mode=None, reply_markup=main_menu_kb())
+
+
+# ---------- выгрузка каталога ----------
+@dp.message(Command("export"))
+@admin_only
+async def export_(m: Message):
+    parts = (m.text or "").strip().split()
+    fmt = parts[1].lower() if len(parts) > 1 else "xlsx"
+    if fmt not in EXPORT_FORMATS:
+        await m.answer("Использование: /export [csv|xlsx]", parse_mode=None)
+        return
+
+    progress = await m.answer("📤 Готовлю выгрузку…", parse_mode=None)
+    started = time.monotonic()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"catalog.{fmt}")
+        count = await export_catalog(path)
+        filename = time.strftime(f"catalog-%Y%m%d-%H%M.{fmt}")
+        await m.answer_document(
+            FSInputFile(path, filename=filename),
+            caption=f"Товаров: {count}, {time.monotonic() - started:.1f} с. Файл можно поправить и загрузить через /import.",
+            parse_mode=None,
+        )
+    await progress.delete()
+
+
+# ---------- рассылка ----------
+BROADCAST_HELP = (
+    "Рассылка всем пользователям магазина — от имени бота магазина.\n"
+    "Пришлите текст или фото с подписью (форматирование сохранится).\n"
+    "Карточка товара: /broadcast <id>. Остановить идущую: /broadcast stop"
+)
+
+# бот магазина и воркер рассылки; создаются в on_startup, если задан BOT_TOKEN
+shop_bot = None
+broadcaster: Optional[BroadcastWorker] = None
+
+
+def broadcast_confirm_kb(n: int):
+    kb = InlineKeyboardBuilder()
+    kb.button(text=f"📣 Отправить ({n})", callback_data="bc:go")
+    kb.button(text="🚫 Отмена", callback_data="menu_cancel")
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+def broadcast_progress_text(b: Broadcast) -> str:
+    status = {
+        "pending": "в очереди",
+        "running": "идёт",
+        "done": "завершена",
+        "cancelled": "остановлена",
+    }.get(b.status, b.status)
+    return (
+        f"📣 Рассылка #{b.id} {status}\n"
+        f"Отправлено: {b.sent}, заблокировали бота: {b.blocked}, ошибок: {b.failed}"
+    )
+
+
+async def show_broadcast_progress(b: Broadcast):
+    """Колбэк воркера: правим сообщение с прогрессом у админа, поставившего рассылку."""
+    if not (b.admin_chat_id and b.progress_message_id):
+        return
+    try:
+        await bot.edit_message_text(
+            broadcast_progress_text(b), chat_id=b.admin_chat_id, message_id=b.progress_message_id, parse_mode=None,
+        )
+    except TelegramBadRequest:
+        pass  # «message is not modified» и т.п.
+
+
+async def product_broadcast_draft(pid: int) -> Optional[dict]:
+    p = await load_product_card(pid)
+    if not p:
+        return None
+    pics = [
+        i for i in sorted(p.images, key=lambda i: (i.sort_order, i.id))
+        if os.path.exists(os.path.join(settings.MEDIA_ROOT, i.path))
+    ]
+    lines = [f"<b>{escape(p.title or '')}</b>", escape(p.subtitle or ""), f"Цена: {p.price}₽"]
+    return {
+        "kind": "product",
+        "text": "\n".join(line for line in lines if line),
+        "photo_path": pics[0].path if pics else None,
+        "product_id": p.id,
+    }
+
+
+async def preview_broadcast(m: Message, state: FSMContext, draft: dict):
+    """Админ видит сообщение так же, как его получат пользователи, и подтверждает отправку."""
+    await state.set_state(BroadcastState.content)  # следующее сообщение заменит черновик
+    await state.update_data(broadcast=draft)
+    reply_markup = broadcast_markup(draft.get("product_id"))
+    if draft.get("photo"):
+        await m.answer_photo(draft["photo"], caption=draft["text"], reply_markup=reply_markup)
+    elif draft.get("photo_path"):
+        photo = FSInputFile(os.path.join(settings.MEDIA_ROOT, draft["photo_path"]))
+        await m.answer_photo(photo, caption=draft["text"], reply_markup=reply_markup)
+    else:
+        await m.answer(draft["text"], reply_markup=reply_markup, disable_web_page_preview=True)
+    n = await count_recipients()
+    minutes = n / settings.BROADCAST_RATE / 60
+    await m.answer(
+        f"Так сообщение увидят пользователи. Получателей: {n}, займёт около {max(1, round(minutes))} мин.\n"
+        "Пришлите другое сообщение, чтобы заменить.",
+        parse_mode=None,
+        reply_markup=broadcast_confirm_kb(n),
+    )
+
+
+async def ask_broadcast(m: Message, state: FSMContext):
+    if broadcaster is None:
+        await m.answer("Рассылка недоступна: не задан BOT_TOKEN бота магазина.", parse_mode=None)
+        return
+    await state.set_state(BroadcastState.content)
+    await m.answer(BROADCAST_HELP, parse_mode=None, reply_markup=cancel_menu_kb())
+
+
+@dp.message(Command("broadcast"))
+@admin_only
+async def broadcast_(m: Message, state: FSMContext):
+    arg = (m.text or "").partition(" ")[2].strip()
+    if arg.lower() == "stop":
+        await state.clear()
+        ids = await cancel_active()
+        text = "Остановлено: " + ", ".join(f"#{i}" for i in ids) if ids else "Активных рассылок нет."
+        await m.answer(text, parse_mode=None)
+        return
+    if arg.isdigit() and broadcaster is not None:
+        draft = await product_broadcast_draft(int(arg))
+        if draft is None:
+            await m.answer("Нет такого товара", parse_mode=None)
+            return
+        await preview_broadcast(m, state, draft)
+        return
+    await ask_broadcast(m, state)
+
+
+@dp.message(BroadcastState.content, F.photo)
+@admin_only
+async def broadcast_photo(m: Message, state: FSMContext):
+    draft = {"kind": "photo", "text": m.html_text if m.caption else None, "photo": m.photo[-1].file_id}
+    await preview_broadcast(m, state, draft)
+
+
+@dp.message(BroadcastState.content, F.text)
+@admin_only
+async def broadcast_text(m: Message, state: FSMContext):
+    await preview_broadcast(m, state, {"kind": "text", "text": m.html_text})
+
+
+@dp.callback_query(F.data == "bc:go")
+@admin_only
+async def cb_broadcast_go(cb: CallbackQuery, state: FSMContext):
+    draft = (await state.get_data()).get("broadcast")
+    if not draft or broadcaster is None:
+        await cb.answer("Нечего отправлять")
+        return
+    await cb.answer()
+    await state.clear()
+
+    photo_path = draft.get("photo_path")
+    if draft.get("photo"):
+        # file_id админ-бота боту магазина не годится: файл загрузится заново при первой отправке
+        photo_path = f"{PHOTOS_DIR}/{uuid.uuid4().hex}.jpg"
+        dest = os.path.join(settings.MEDIA_ROOT, photo_path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        await bot.download(draft["photo"], destination=dest)
+
+    progress = await cb.message.answer("📣 Рассылка поставлена в очередь…", parse_mode=None)
+    async with SessionLocal() as s:
+        b = Broadcast(
+            kind=draft["kind"],
+            text=draft["text"],
+            photo_path=photo_path,
+            product_id=draft.get("product_id"),
+            admin_chat_id=cb.message.chat.id,
+            progress_message_id=progress.message_id,
+        )
+        s.add(b)
+        await s.commit()
+    await edit_quiet(progress, broadcast_progress_text(b))
+    broadcaster.notify()
+    await cb.message.answer("Остановить — /broadcast stop", parse_mode=None, reply_markup=main_menu_kb())
+
+
 # ---------- кнопочное меню ----------
 @dp.callback_query(F.data == "menu_new")
 @admin_only
@@ -413,19 +1008,11 @@ async def cb_new(cb: CallbackQuery, state: FSMContext):
 
 @dp.callback_query(F.data == "menu_list")
 @admin_only
-async def cb_list(cb: CallbackQuery):
+async def cb_list(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
-    async with SessionLocal() as s:
-        res = await s.execute(select(Product).order_by(Product.id.desc()))
-        items = res.scalars().all()
-    if not items:
-        await cb.message.answer("Пусто.", parse_mode=None)
-        return
-    lines = []
-    for p in items:
-        cat = get_category_text(p)
-        lines.append(f"#{p.id} — {p.title} — {p.price}₽ ({p.status}) [{cat}]")
-    await cb.message.answer("\n".join(lines), parse_mode=None)
+    await state.update_data(lst={})
+    text, kb = await render_list_page({})
+    await cb.message.answer(text, reply_markup=kb, parse_mode=None)
 
 
 @dp.callback_query(F.data == "menu_view")
@@ -452,6 +1039,21 @@ async def cb_addphoto(cb: CallbackQuery, state: FSMContext):
     await cb.message.answer("Введите ID товара, к которому добавить фото:", parse_mode=None, reply_markup=cancel_menu_kb())
 
 
+@dp.callback_query(F.data == "menu_import")
+@admin_only
+async def cb_import(cb: CallbackQuery, state: FSMContext):
+    await cb.answer()
+    await state.set_state(ImportState.file)
+    await cb.message.answer(IMPORT_HELP, parse_mode=None, reply_markup=cancel_menu_kb())
+
+
+@dp.callback_query(F.data == "menu_broadcast")
+@admin_only
+async def cb_broadcast(cb: CallbackQuery, state: FSMContext):
+    await cb.answer()
+    await ask_broadcast(cb.message, state)
+
+
 @dp.callback_query(F.data == "menu_cancel")
 @admin_only
 async def cb_cancel(cb: CallbackQuery, state: FSMContext):
@@ -466,23 +1068,11 @@ async def id_view_flow(m: Message, state: FSMContext):
     if not (m.text or "").isdigit():
         await m.answer("Нужен числовой ID.", parse_mode=None)
         return
-    pid = int(m.text)
-    async with SessionLocal() as s:
-        p = await s.get(Product, pid)
+    p = await load_product_card(int(m.text))
     if not p:
         await m.answer("Нет такого товара", parse_mode=None)
         return
-    pics = sorted(p.images, key=lambda i: (i.sort_order, i.id))
-    title = escape(p.title or "")
-    subtitle = escape(p.subtitle or "")
-    status = escape(p.status or "")
-    cat = escape(get_category_text(p))
-    await m.answer(
-        f"<b>#{p.id}</b> {title}\n{subtitle}\n{status}\n"
-        f"Цена: {p.price}₽\nКатегория: {cat}\n"
-        f"Фото: {[i.id for i in pics]}",
-        parse_mode="HTML",
-    )
+    await send_product_card(m, p)
     await state.clear()
     await m.answer("Готово.", parse_mode=None, reply_markup=main_menu_kb())
 
@@ -494,14 +1084,9 @@ async def id_del_flow(m: Message, state: FSMContext):
         await m.answer("Нужен числовой ID.", parse_mode=None)
         return
     pid = int(m.text)
-    async with SessionLocal() as s:
-        obj = await s.get(Product, pid)
-        if not obj:
-            await m.answer("Нет такого товара", parse_mode=None)
-            return
-        await s.delete(obj)
-        await s.commit()
-    shutil.rmtree(product_dir(pid), ignore_errors=True)
+    if not await delete_product(pid):
+        await m.answer("Нет такого товара", parse_mode=None)
+        return
     await m.answer(f"Удалено #{pid}", parse_mode=None)
     await state.clear()
     await m.answer("Готово.", parse_mode=None, reply_markup=main_menu_kb())
@@ -514,24 +1099,48 @@ async def id_addphoto_flow(m: Message, state: FSMContext):
         await m.answer("Нужен числовой ID.", parse_mode=None)
         return
     pid = int(m.text)
-    os.makedirs(product_dir(pid), exist_ok=True)
     await state.set_state(NewProduct.photos)
     await state.update_data(product_id=pid, order=0)
     await m.answer(f"Ок. Жду фото для #{pid}. Завершение — /done", parse_mode=None)
 
 
+async def on_startup():
+    """Общее для polling и webhook-режима (в нём вызывается из server/webhooks.py)."""
+    global shop_bot, broadcaster
+    os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+    await setup_bot_ui()
+    # рассылка идёт от бота магазина; незаконченная после рестарта продолжится сама
+    if settings.BOT_TOKEN and broadcaster is None:
+        shop_bot = create_bot(settings.BOT_TOKEN)
+        broadcaster = BroadcastWorker(shop_bot, on_progress=show_broadcast_progress)
+        broadcaster.start()
+
+
+@dp.shutdown()
+async def on_shutdown():
+    global shop_bot, broadcaster
+    if broadcaster is not None:
+        await broadcaster.stop()
+        await shop_bot.session.close()
+        shop_bot = broadcaster = None
+
+
 async def main():
     if not settings.ADMIN_BOT_TOKEN:
         raise RuntimeError("Нужен ADMIN_BOT_TOKEN")
-
-    os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+    if settings.BOT_MODE == "webhook":
+        log.info("BOT_MODE=webhook: апдейты принимает сервер (/tg/admin), polling не запускается")
+        return
 
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await migrate(conn)
 
-    await setup_bot_ui()
+    await on_startup()
 
+    # после webhook-режима getUpdates вернёт Conflict, пока вебхук не снят
+    await bot.delete_webhook()
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
     asyncio.run(main())
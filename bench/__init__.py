@@ -0,0 +1,2 @@
+# bench/__init__.py
+"""Нагрузочный бенчмарк API на синтетическом каталоге: python -m bench --help"""
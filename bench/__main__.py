@@ -0,0 +1,236 @@
+# bench/__main__.py
+"""Бенчмарк API в процессе (httpx + ASGI, без сети), результат — JSON.
+
+    python -m bench --products 5000 --requests 500 --concurrency 16 --out before.json
+    python -m bench --compare before.json --out after.json
+
+По умолчанию — временная SQLite; --database-url postgresql+asyncpg://... для локального
+Postgres (схема пересоздаётся!). Telegram заглушен: отправка сообщений ничего не делает.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+
+def _parse_args():
+    p = argparse.ArgumentParser(prog="python -m bench", description="Бенчмарк API магазина")
+    p.add_argument("--database-url", default="", help="по умолчанию — временная SQLite")
+    p.add_argument("--products", type=int, default=5000)
+    p.add_argument("--images", type=int, default=3, help="фото на товар")
+    p.add_argument("--users", type=int, default=2000)
+    p.add_argument("--logs-per-user", type=int, default=5)
+    p.add_argument("--requests", type=int, default=300, help="запросов на сценарий")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--warmup", type=int, default=20)
+    p.add_argument("--only", default="", help="сценарии через запятую")
+    p.add_argument("--no-seed", action="store_true", help="использовать уже заполненную БД")
+    p.add_argument("--out", default="", help="куда записать JSON (по умолчанию stdout)")
+    p.add_argument("--compare", default="", help="JSON прошлого прогона для сравнения")
+    return p.parse_args()
+
+
+def _configure_env(args, workdir: str):
+    """Настройки читаются при импорте config — выставляем окружение до импорта server.*"""
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{workdir}/bench.db"
+    os.environ["MEDIA_ROOT"] = os.path.join(workdir, "media")
+    os.makedirs(os.environ["MEDIA_ROOT"], exist_ok=True)
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCHBENCHBENCHBENCHBENCHBENCHBENCH")
+    os.environ.setdefault("SELLER_CHAT_ID", "1")
+
+
+def _init_data(bot_token: str, user_id: int) -> str:
+    user = {"id": user_id, "first_name": "Bench", "username": f"bench{user_id}"}
+    data = {"user": json.dumps(user), "auth_date": str(int(time.time())), "query_id": f"bench{user_id}"}
+    data_check = "\n".join(f"{k}={v}" for k, v in sorted(data.items()))
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    data["hash"] = hmac.new(secret, data_check.encode(), hashlib.sha256).hexdigest()
+    return urllib.parse.urlencode(data)
+
+
+def _scenarios(ctx: dict, bot_token: str) -> dict:
+    """Имя -> функция(rnd) -> (метод, url, kwargs для httpx)."""
+    ids, cats, words = ctx["active_ids"], ctx["categories"], ctx["words"]
+    init_data = [_init_data(bot_token, 10_000 + n) for n in range(50)]
+
+    def cart(rnd):
+        items = [
+            {"id": pid, "title": f"Товар {pid}", "qty": rnd.randint(1, 3), "price": 1000.0}
+            for pid in rnd.sample(ids, min(3, len(ids)))
+        ]
+        body = {"items": items, "total": sum(i["qty"] * i["price"] for i in items), "init_data": rnd.choice(init_data)}
+        return "POST", "/api/submit_cart", {"json": body}
+
+    return {
+        "products": lambda rnd: ("GET", "/api/products?limit=40", {}),
+        "products_all": lambda rnd: ("GET", "/api/products", {}),
+        "products_category": lambda rnd: ("GET", "/api/products", {"params": {"category": rnd.choice(cats), "limit": 40}}),
+        "products_sort": lambda rnd: ("GET", "/api/products", {"params": {"sort": rnd.choice(["price_asc", "price_desc"]), "limit": 40}}),
+        "products_q": lambda rnd: ("GET", "/api/products", {"params": {"q": rnd.choice(words), "limit": 40}}),
+        "products_q_category": lambda rnd: ("GET", "/api/products", {"params": {"q": rnd.choice(words), "category": rnd.choice(cats), "limit": 40}}),
+        "categories": lambda rnd: ("GET", "/api/categories", {}),
+        "product": lambda rnd: ("GET", f"/api/products/{rnd.choice(ids)}", {}),
+        "submit_cart": cart,
+    }
+
+
+def _percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[k]
+
+
+async def _run_scenario(client, make, total: int, concurrency: int, warmup: int, seed_value: int) -> dict:
+    rnd = random.Random(seed_value)
+    for _ in range(warmup):
+        method, url, kw = make(rnd)
+        await client.request(method, url, **kw)
+
+    latencies, errors = [], 0
+    queue = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in queue:
+            method, url, kw = make(rnd)
+            t0 = time.perf_counter()
+            r = await client.request(method, url, **kw)
+            latencies.append(time.perf_counter() - t0)
+            if r.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 3)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else 0.0,
+        "p50_ms": ms(_percentile(latencies, 50)),
+        "p95_ms": ms(_percentile(latencies, 95)),
+        "p99_ms": ms(_percentile(latencies, 99)),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+class _StubSession:
+    """Вместо aiohttp-сессии бота: запросы к Bot API не уходят в сеть (close и пр. — настоящей)."""
+
+    def __init__(self, session):
+        self._session = session
+
+    async def __call__(self, bot, method, timeout=None):
+        return True
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+async def _main(args) -> dict:
+    import httpx
+    from sqlalchemy import func, select
+
+    from config import settings
+    from server.db import SessionLocal, engine
+    from server.main import app
+    from server.models import Product
+
+    if args.no_seed:
+        async with SessionLocal() as s:
+            rows = (await s.execute(select(Product.id, Product.category).where(Product.is_active == True))).all()
+            count = await s.scalar(select(func.count(Product.id)))
+        ctx = {"active_ids": [r.id for r in rows], "categories": sorted({r.category for r in rows if r.category}), "words": ["фара", "бампер", "диск"]}
+        seeded = {"products": count}
+    else:
+        from bench.seed import seed
+
+        t0 = time.perf_counter()
+        ctx = await seed(args.products, args.images, args.users, args.logs_per_user)
+        seeded = {"products": args.products, "images_per_product": args.images, "users": args.users,
+                  "logs_per_user": args.logs_per_user, "seconds": round(time.perf_counter() - t0, 2)}
+
+    scenarios = _scenarios(ctx, settings.BOT_TOKEN)
+    if args.only:
+        wanted = [n.strip() for n in args.only.split(",") if n.strip()]
+        scenarios = {n: scenarios[n] for n in wanted}
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        bot = app.state.bot
+        bot.session = _StubSession(bot.session)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for i, (name, make) in enumerate(scenarios.items()):
+                results[name] = await _run_scenario(client, make, args.requests, args.concurrency, args.warmup, i)
+                print(f"{name:22s} {results[name]['rps']:>9.1f} rps  p50 {results[name]['p50_ms']:>8.2f} ms  "
+                      f"p99 {results[name]['p99_ms']:>8.2f} ms  errors {results[name]['errors']}", file=sys.stderr)
+
+    await engine.dispose()
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "database": engine.dialect.name,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": seeded,
+        },
+        "results": results,
+    }
+
+
+def _compare(base: dict, cur: dict):
+    print(f"\n{'scenario':22s} {'rps':>18s} {'p50 ms':>20s} {'p99 ms':>20s}", file=sys.stderr)
+    for name, r in cur["results"].items():
+        b = base.get("results", {}).get(name)
+        if not b:
+            continue
+        cols = []
+        for key in ("rps", "p50_ms", "p99_ms"):
+            delta = (r[key] - b[key]) / b[key] * 100 if b[key] else 0.0
+            cols.append(f"{b[key]:>8.1f}->{r[key]:<8.1f}{delta:+5.0f}%")
+        print(f"{name:22s} " + " ".join(cols), file=sys.stderr)
+
+
+def main():
+    args = _parse_args()
+    with tempfile.TemporaryDirectory(prefix="shop-bench-") as workdir:
+        _configure_env(args, workdir)
+        report = asyncio.run(_main(args))
+
+    out = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            _compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# bench/fake_telegram.py
+"""Фейковый Bot API для локальной проверки ботов без Telegram.
+
+    python -m bench.fake_telegram --port 8081
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_MODE=webhook uvicorn server.main:app
+
+Отвечает ok на любой метод (send* — правдоподобным Message, getUpdates — пустым
+long-poll на секунду, чтобы работал и polling), пишет вызовы в лог;
+GET /calls — все вызовы JSON-ом, DELETE /calls — очистить.
+--blocked 1,2 — этим chat_id send* отвечает 403 (бот заблокирован), как для проверки рассылки.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import time
+
+from aiohttp import web
+
+log = logging.getLogger("fake_telegram")
+
+_message_ids = itertools.count(1)
+
+
+def _result(method: str, token: str, params: dict):
+    bot_id = int(token.split(":", 1)[0]) if token.split(":", 1)[0].isdigit() else 1
+    if method == "getme":
+        return {"id": bot_id, "is_bot": True, "first_name": "Fake", "username": f"fake_{bot_id}_bot"}
+    if method == "getwebhookinfo":
+        return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+    if method.startswith("send"):
+        chat_id = params.get("chat_id", 0)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        message_id = next(_message_ids)
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text") or params.get("caption") or "",
+        }
+        if method == "sendphoto":
+            photo = params.get("photo", "")
+            # загрузка файла приходит как attach://<поле>, повторная отправка — готовым file_id
+            file_id = f"fake-photo-{message_id}" if photo.startswith(("attach://", "<file")) else photo
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 800, "height": 600}]
+        return message
+    return True
+
+
+async def _method(request: web.Request) -> web.Response:
+    token, method = request.match_info["token"], request.match_info["method"]
+    if request.content_type == "application/json":
+        params = await request.json()
+    else:
+        params = {}
+        for k, v in (await request.post()).items():
+            params[k] = v if isinstance(v, str) else f"<file {getattr(v, 'filename', '')}>"
+    if method.lower() == "getupdates":
+        await asyncio.sleep(1)
+        return web.json_response({"ok": True, "result": []})
+    request.app["calls"].append({"token": token, "method": method, "params": params})
+    if method.lower().startswith("send") and str(params.get("chat_id")) in request.app["blocked"]:
+        return web.json_response(
+            {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}, status=403
+        )
+    log.info("%s %s", method, json.dumps(params, ensure_ascii=False)[:200])
+    return web.json_response({"ok": True, "result": _result(method.lower(), token, params)})
+
+
+async def _calls(request: web.Request) -> web.Response:
+    if request.method == "DELETE":
+        request.app["calls"].clear()
+    return web.json_response(request.app["calls"])
+
+
+def make_app(blocked=()) -> web.Application:
+    app = web.Application()
+    app["calls"] = []
+    app["blocked"] = {str(chat_id) for chat_id in blocked}
+    app.router.add_route("*", "/calls", _calls)
+    app.router.add_post("/bot{token}/{method}", _method)
+    return app
+
+
+def main():
+    p = argparse.ArgumentParser(prog="python -m bench.fake_telegram", description="Фейковый Bot API")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8081)
+    p.add_argument("--blocked", default="", help="chat_id через запятую, для которых send* отвечает 403")
+    args = p.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    blocked = [x.strip() for x in args.blocked.split(",") if x.strip()]
+    web.run_app(make_app(blocked), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# bench/seed.py
+"""Синтетический каталог для бенчмарка: товары по CATEGORY_CHOICES, фото, пользователи и логи.
+
+Импортируется только после того, как bench/__main__.py выставил DATABASE_URL и прочие переменные."""
+import random
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert
+
+from server.db import Base, engine
+from server.main import CATEGORY_CHOICES
+from server.migrations import migrate
+from server.models import Product, ProductImage, User, UserLog, UserLogAction
+
+CHUNK = 1000
+
+_NOUNS = [
+    "бампер", "фара", "крыло", "капот", "радиатор", "помпа", "диск", "колодки", "суппорт",
+    "стойка", "рычаг", "зеркало", "фонарь", "решётка", "подкрылок", "ремень", "фильтр",
+    "термостат", "наконечник", "сиденье", "ковры", "молдинг", "датчик", "шланг",
+]
+_ADJ = ["передний", "задний", "левый", "правый", "верхний", "нижний", "оригинальный", "усиленный"]
+_CARS = ["Camry", "Corolla", "Solaris", "Rio", "Polo", "Octavia", "Focus", "Vesta", "X-Ray", "Logan"]
+
+
+def _chunks(rows, size=CHUNK):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+async def seed(products: int, images: int, users: int, logs_per_user: int, seed_value: int = 1) -> dict:
+    """Пересоздаёт схему и заполняет её; возвращает список id и категорий для сценариев."""
+    rnd = random.Random(seed_value)
+    now = datetime.now(timezone.utc)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        if conn.dialect.name == "sqlite":
+            await conn.exec_driver_sql("DROP TABLE IF EXISTS products_fts")
+        await migrate(conn)
+
+    product_rows = []
+    for pid in range(1, products + 1):
+        title = f"{rnd.choice(_NOUNS).capitalize()} {rnd.choice(_ADJ)} {rnd.choice(_CARS)}"
+        product_rows.append({
+            "id": pid,
+            "title": title,
+            "subtitle": f"Арт. {rnd.randint(100000, 999999)}",
+            "status": rnd.choice(["в наличии", "под заказ"]),
+            "price": float(rnd.randint(300, 90000)),
+            "is_active": rnd.random() > 0.05,
+            "category": rnd.choice(CATEGORY_CHOICES),
+            "created_at": now - timedelta(minutes=products - pid),
+            "updated_at": now - timedelta(minutes=products - pid),
+        })
+    image_rows = [
+        {"product_id": pid, "path": f"products/{pid}/{n}.jpg", "sort_order": n}
+        for pid in range(1, products + 1)
+        for n in range(images)
+    ]
+    user_rows = [
+        {"id": 10_000 + uid, "username": f"user{uid}", "name": f"Покупатель {uid}", "first_entry": now}
+        for uid in range(users)
+    ]
+    log_rows = [
+        {"user_id": 10_000 + uid, "action": UserLogAction.WEB_APP_OPENED.value, "datetime": now - timedelta(hours=n)}
+        for uid in range(users)
+        for n in range(logs_per_user)
+    ]
+
+    async with engine.begin() as conn:
+        for model, rows in ((Product, product_rows), (ProductImage, image_rows), (User, user_rows), (UserLog, log_rows)):
+            for chunk in _chunks(rows):
+                await conn.execute(insert(model), chunk)
+        if conn.dialect.name == "postgresql":
+            await conn.exec_driver_sql("SELECT setval('products_id_seq', (SELECT max(id) FROM products))")
+            await conn.exec_driver_sql("ANALYZE")
+
+    active = [r["id"] for r in product_rows if r["is_active"]]
+    return {
+        "active_ids": active,
+        "categories": sorted({r["category"] for r in product_rows}),
+        "words": _NOUNS + _CARS,
+    }
@@ -1,41 +1,35 @@
 # bot/bot.py
 import asyncio
+import logging
 from typing import Optional
 from sqlalchemy import select
-from aiogram import Bot, Dispatcher
+from aiogram import Dispatcher
 from aiogram.filters import CommandStart
 from aiogram.types import (
     ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo, Message
 )
-from aiogram.client.default import DefaultBotProperties
 
 from config import settings
 from server.db import SessionLocal
 from server.models import User
+from server.telegram import create_bot
+from server.users import upsert_user
 
-bot = Bot(settings.BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-dp = Dispatcher()
-
+log = logging.getLogger(__name__)
 
-async def user_exists(
-    user_id: int,
-):
-    async with SessionLocal() as session:
-        select_query = select(User).filter(User.id == user_id)
-        result = await session.execute(select_query)
-        user = result.scalar_one_or_none()
-        return user is not None
+bot = create_bot(settings.BOT_TOKEN)
+dp = Dispatcher()
 
 
 async def save_user(
-    user: User,
+    user_id: int,
+    username: Optional[str],
+    name: Optional[str],
 ) -> User:
     async with SessionLocal() as db:
-        if not await user_exists(user_id=user.id):
-            db.add(user)
-            await db.commit()
-            await db.refresh(user)
-            return user
+        user = await upsert_user(db, user_id, username, name)
+        await db.commit()
+        return user
 
 
 async def get_user(
@@ -48,11 +42,9 @@ async def get_user(
 @dp.message(CommandStart())
 async def start(m: Message):
     await save_user(
-        user=User(
-            id=m.from_user.id,
-            username=m.from_user.username,
-            name=m.from_user.first_name,
-        )
+        user_id=m.from_user.id,
+        username=m.from_user.username,
+        name=m.from_user.first_name,
     )
 
     await m.answer("...", reply_markup=ReplyKeyboardRemove())
@@ -68,7 +60,13 @@ async def start(m: Message):
 async def main():
     if not settings.BOT_TOKEN or not settings.WEBAPP_URL:
         raise RuntimeError("Нужны BOT_TOKEN и WEBAPP_URL в .env")
+    if settings.BOT_MODE == "webhook":
+        log.info("BOT_MODE=webhook: апдейты принимает сервер (/tg/shop), polling не запускается")
+        return
+    # после webhook-режима getUpdates вернёт Conflict, пока вебхук не снят
+    await bot.delete_webhook()
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
     asyncio.run(main())
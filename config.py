@@ -15,11 +15,48 @@ class Settings:
     SELLER_CHAT_ID: int = int(os.getenv("SELLER_CHAT_ID", "0"))
     WEBAPP_URL: str = os.getenv("WEBAPP_URL", "")
     PORT: int = int(os.getenv("PORT", "8000"))
+    # сколько секунд initData мини-аппа считается свежим (auth_date); 0 — не проверять
+    INIT_DATA_MAX_AGE: int = int(os.getenv("INIT_DATA_MAX_AGE", "86400"))
+    # максимум одновременных соединений к Bot API из одного процесса
+    TG_POOL_SIZE: int = int(os.getenv("TG_POOL_SIZE", "20"))
+    # доставка уведомлений о заказах из outbox; на SQLite держите включённым в одном процессе
+    OUTBOX_WORKER: bool = os.getenv("OUTBOX_WORKER", "1") == "1"
+    # буфер событий мини-аппа: сброс в БД по размеру или по таймеру (сек)
+    EVENTS_FLUSH_SIZE: int = int(os.getenv("EVENTS_FLUSH_SIZE", "200"))
+    EVENTS_FLUSH_INTERVAL: float = float(os.getenv("EVENTS_FLUSH_INTERVAL", "2"))
 
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./shop.db")
+    # пул соединений (профили для SQLite и Postgres — в readme)
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # сек; -1 — не пересоздавать
+    DB_POOL_PRE_PING: str = os.getenv("DB_POOL_PRE_PING", "auto")  # auto | 1 | 0
+    DB_STATEMENT_CACHE_SIZE: int = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))  # asyncpg; 0 за pgbouncer
+    # SQLite: PRAGMA при каждом подключении
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    SQLITE_CACHE_SIZE: int = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # < 0 — в КиБ
+    SQLITE_BUSY_TIMEOUT: int = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # мс
     MEDIA_ROOT: str = os.getenv("MEDIA_ROOT", "media")
+    IMAGE_WORKERS: int = int(os.getenv("IMAGE_WORKERS", "2"))
+
+    # снимок каталога в памяти сервера; версия в БД проверяется не чаще раза в TTL секунд
+    CATALOG_CACHE: bool = os.getenv("CATALOG_CACHE", "1") == "1"
+    CATALOG_CACHE_TTL: float = float(os.getenv("CATALOG_CACHE_TTL", "2"))
 
     ADMIN_BOT_TOKEN: str = os.getenv("ADMIN_BOT_TOKEN", "")
     ADMIN_IDS: list = tuple(_parse_admin_ids(os.getenv("ADMIN_IDS", "")))
 
+    # polling — каждый бот в своём процессе (локально); webhook — апдейты принимает сервер на /tg/<бот>
+    BOT_MODE: str = os.getenv("BOT_MODE", "polling")
+    # публичный адрес, по которому Telegram достучится до /tg/... (по умолчанию — origin WEBAPP_URL)
+    TG_WEBHOOK_BASE: str = os.getenv("TG_WEBHOOK_BASE", "")
+    # X-Telegram-Bot-Api-Secret-Token; пусто — выводится из токена бота
+    TG_WEBHOOK_SECRET: str = os.getenv("TG_WEBHOOK_SECRET", "")
+    # свой Bot API сервер (telegram-bot-api или фейк для тестов); пусто — api.telegram.org
+    TELEGRAM_API_URL: str = os.getenv("TELEGRAM_API_URL", "")
+
+    # рассылка /broadcast: сообщений в секунду на весь бот (лимит Telegram ~30) и параллельных запросов
+    BROADCAST_RATE: float = float(os.getenv("BROADCAST_RATE", "25"))
+    BROADCAST_CONCURRENCY: int = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+
 settings = Settings()
@@ -0,0 +1,103 @@
+# server/auth.py
+"""Проверка Telegram WebApp initData.
+
+Секретный ключ HMAC считается один раз на токен бота; успешно проверенные строки initData
+кладутся в ограниченный LRU с TTL, так что повторные запросы той же сессии мини-аппа
+не парсят и не хэшируют её заново. Устаревшие initData (auth_date старше max_age)
+отклоняются — это ограничивает окно повторного использования перехваченной строки.
+"""
+import hashlib
+import hmac
+import json
+import time
+import urllib.parse
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+
+@dataclass(frozen=True)
+class InitData:
+    user: Optional[dict]
+    auth_date: int
+    query_id: Optional[str] = None
+
+
+class InitDataVerifier:
+    def __init__(self, bot_token: str, max_age: int = 86400, cache_size: int = 4096, cache_ttl: float = 300.0):
+        self._secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+        self.max_age = max_age
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache: "OrderedDict[str, Tuple[float, InitData]]" = OrderedDict()
+
+    def _parse(self, init_data: str) -> Tuple[Optional[InitData], bool]:
+        data = dict(urllib.parse.parse_qsl(init_data, keep_blank_values=True))
+        received_hash = data.pop("hash", "")
+        data_check = "\n".join(f"{k}={v}" for k, v in sorted(data.items()))
+        check_hash = hmac.new(self._secret, data_check.encode(), hashlib.sha256).hexdigest()
+        valid = hmac.compare_digest(check_hash, received_hash)
+
+        user = None
+        if "user" in data:
+            try:
+                user = json.loads(data["user"])
+            except Exception:
+                user = None
+        try:
+            auth_date = int(data.get("auth_date") or 0)
+        except ValueError:
+            auth_date = 0
+        return InitData(user=user, auth_date=auth_date, query_id=data.get("query_id")), valid
+
+    def _fresh(self, parsed: InitData, now: float) -> bool:
+        return not self.max_age or now - parsed.auth_date <= self.max_age
+
+    def verify(self, init_data: str) -> Optional[InitData]:
+        """Данные, если подпись верна и auth_date свежий; иначе None."""
+        if not init_data:
+            return None
+        now = time.time()
+        hit = self._cache.get(init_data)
+        if hit is not None:
+            expires, parsed = hit
+            if now < expires:
+                self._cache.move_to_end(init_data)
+                return parsed
+            del self._cache[init_data]
+
+        parsed, valid = self._parse(init_data)
+        if not valid or not self._fresh(parsed, now):
+            return None
+
+        expires = now + self.cache_ttl
+        if self.max_age:
+            expires = min(expires, parsed.auth_date + self.max_age)
+        self._cache[init_data] = (expires, parsed)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return parsed
+
+    def check(self, init_data: str) -> Tuple[Optional[dict], bool]:
+        """(user, valid) — пользователь возвращается и при неверной подписи, как раньше в submit_cart."""
+        if not init_data:
+            return None, False
+        parsed = self.verify(init_data)
+        if parsed is not None:
+            return parsed.user, True
+        parsed, _ = self._parse(init_data)
+        return parsed.user, False
+
+    async def __call__(self, request: Request) -> InitData:
+        """FastAPI-зависимость: initData из заголовка «Authorization: tma <initData>»
+        или X-Telegram-Init-Data; 401, если их нет или они не прошли проверку."""
+        init_data = request.headers.get("x-telegram-init-data", "")
+        auth = request.headers.get("authorization", "")
+        if auth[:4].lower() == "tma ":
+            init_data = auth[4:].strip()
+        parsed = self.verify(init_data)
+        if parsed is None or not parsed.user:
+            raise HTTPException(status_code=401, detail="invalid init data")
+        return parsed
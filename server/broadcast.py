@@ -0,0 +1,445 @@
+# server/broadcast.py
+"""Массовая рассылка всем пользователям (таблица users) от имени бота магазина.
+
+Лимиты Telegram: около 30 сообщений в секунду на бота суммарно и не чаще ~1 в секунду в один
+чат. Общий лимит держит TokenBucket (BROADCAST_RATE, по умолчанию 25/с — с запасом); каждому
+пользователю уходит ровно одно сообщение, так что лимит на чат соблюдается сам собой.
+RetryAfter — flood wait всего бота: ведро встаёт на паузу, а сообщение повторяется.
+Заблокировавшие бота (Forbidden) помечаются users.is_blocked и в следующие рассылки не попадают.
+
+Прогресс хранится в строке broadcasts: cursor (id пользователя, до которого всё обработано),
+счётчики и аренда locked_until; сбрасывается раз в секунду. После рестарта рассылку
+продолжает воркер любого процесса с cursor — повторно могут уйти только сообщения последней
+секунды перед падением. Одновременно идёт одна рассылка: ведро у каждого процесса своё.
+100k пользователей при 25/с — около 70 минут; быстрее бесплатный лимит Telegram не пускает.
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List, Optional, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
+from sqlalchemy import case, exists, func, or_, select, update
+from sqlalchemy.orm import aliased
+
+from config import settings
+from server.db import SessionLocal
+from server.models import Broadcast, BroadcastStatus, User
+
+log = logging.getLogger(__name__)
+
+PHOTOS_DIR = "broadcasts"  # фото из админ-бота, относительно MEDIA_ROOT
+BATCH_SIZE = 500  # пользователей на одну выборку из БД
+POLL_INTERVAL = 30.0  # сек; новые рассылки будят воркер сразу через notify()
+LEASE = 60.0  # сек; продлевается при каждом сбросе прогресса
+FLUSH_INTERVAL = 1.0
+PROGRESS_INTERVAL = 5.0  # как часто обновлять сообщение с прогрессом у админа
+MAX_ATTEMPTS = 3  # для сетевых ошибок; RetryAfter попыткой не считается
+BACKOFF_BASE = 2.0
+
+SENT, FAILED, BLOCKED = "sent", "failed", "blocked"
+_ACTIVE = (BroadcastStatus.PENDING.value, BroadcastStatus.RUNNING.value)
+
+ProgressCallback = Callable[[Broadcast], Awaitable[None]]
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(dt: datetime) -> datetime:
+    # SQLite возвращает naive datetime
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+class TokenBucket:
+    """rate отправок в секунду, подряд — не больше burst; pause() — общий flood wait."""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        self._updated = self._paused_until
+
+
+def markup(product_id: Optional[int] = None) -> Optional[InlineKeyboardMarkup]:
+    """Кнопка мини-аппа под сообщением: у карточки товара — сразу на товар."""
+    if not settings.WEBAPP_URL:
+        return None
+    if product_id:
+        button = InlineKeyboardButton(
+            text="🛍️ Открыть товар", web_app=WebAppInfo(url=f"{settings.WEBAPP_URL}#product={product_id}")
+        )
+    else:
+        button = InlineKeyboardButton(text="🛍️ Открыть магазин", web_app=WebAppInfo(url=settings.WEBAPP_URL))
+    return InlineKeyboardMarkup(inline_keyboard=[[button]])
+
+
+def recipients_filter():
+    return or_(User.is_blocked.is_(None), User.is_blocked.is_(False))
+
+
+async def count_recipients() -> int:
+    async with SessionLocal() as s:
+        return await s.scalar(select(func.count(User.id)).where(recipients_filter()))
+
+
+def discard_photo(b: Broadcast):
+    """Фото, присланное для рассылки, после неё не нужно (у карточки товара — фото товара, не трогаем)."""
+    if b.kind != "photo" or not b.photo_path:
+        return
+    try:
+        os.remove(os.path.join(settings.MEDIA_ROOT, b.photo_path))
+    except FileNotFoundError:
+        pass
+
+
+async def cancel_active() -> List[int]:
+    """Останавливает ожидающие и идущие рассылки; возвращает их id.
+    Идущую воркер увидит при ближайшем сбросе прогресса и уберёт за собой сам."""
+    now = _now()
+    async with SessionLocal() as s:
+        rows = (await s.scalars(select(Broadcast).where(Broadcast.status.in_(_ACTIVE)))).all()
+        if not rows:
+            return []
+        await s.execute(
+            update(Broadcast)
+            .where(Broadcast.id.in_([b.id for b in rows]), Broadcast.status.in_(_ACTIVE))
+            .values(status=BroadcastStatus.CANCELLED.value, finished_at=now)
+        )
+        await s.commit()
+    for b in rows:
+        if b.locked_until is None or _as_utc(b.locked_until) < now:
+            discard_photo(b)  # никто не ведёт
+    return [b.id for b in rows]
+
+
+class _LeaseLost(Exception):
+    pass
+
+
+@dataclass
+class _Run:
+    """Рассылка в работе у этого процесса."""
+    b: Broadcast
+    lease: datetime
+    photo: Union[str, FSInputFile, None] = None
+    uploaded: bool = True  # file_id уже есть — можно слать параллельно
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+    blocked_ids: List[int] = field(default_factory=list)
+    stopped: bool = False
+    finished: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+@dataclass
+class _Batch:
+    """Пачка пользователей: результаты приходят вразнобой, cursor двигается только по сплошному префиксу."""
+    ids: List[int]
+    results: List[Optional[str]] = field(default_factory=list)
+    next: int = 0
+    done: int = 0
+
+    def __post_init__(self):
+        self.results = [None] * len(self.ids)
+
+    def take(self) -> Optional[int]:
+        if self.next >= len(self.ids):
+            return None
+        self.next += 1
+        return self.next - 1
+
+
+class BroadcastWorker:
+    def __init__(
+        self,
+        bot: Bot,
+        on_progress: Optional[ProgressCallback] = None,
+        rate: Optional[float] = None,
+        concurrency: Optional[int] = None,
+        poll_interval: float = POLL_INTERVAL,
+    ):
+        self.bot = bot
+        self.on_progress = on_progress
+        self.bucket = TokenBucket(rate or settings.BROADCAST_RATE)
+        self.concurrency = max(1, concurrency or settings.BROADCAST_CONCURRENCY)
+        self.poll_interval = poll_interval
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="broadcast-worker")
+
+    def notify(self):
+        """Появилась новая рассылка — не ждать следующего опроса."""
+        self._wake.set()
+
+    async def stop(self, timeout: float = 10.0):
+        self._stopping = True
+        self._wake.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                bid = await self.claim()
+                if bid is not None:
+                    await self.run(bid)
+                    continue
+            except Exception:
+                log.exception("broadcast failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def claim(self) -> Optional[int]:
+        """Берёт ожидающую или брошенную (аренда истекла) рассылку, если никто другой сейчас не шлёт.
+
+        «Одна рассылка за раз» держится и между процессами (воркеры uvicorn в webhook-режиме):
+        проверка занятости стоит в самом UPDATE, а на Postgres претенденты ещё и выстраиваются
+        в очередь на блокировках активных строк — иначе два UPDATE разных строк не увидели бы
+        незакоммиченный RUNNING друг друга."""
+        now = _now()
+        free = or_(Broadcast.locked_until.is_(None), Broadcast.locked_until < now)
+        other = aliased(Broadcast)
+        busy = exists().where(other.status == BroadcastStatus.RUNNING.value, other.locked_until >= now)
+        async with SessionLocal() as s:
+            # SQLite FOR UPDATE не знает — там записи и так идут по одной
+            candidates = (
+                await s.scalars(
+                    select(Broadcast.id).where(Broadcast.status.in_(_ACTIVE)).order_by(Broadcast.id).with_for_update()
+                )
+            ).all()
+            bid = await s.scalar(
+                select(Broadcast.id)
+                .where(Broadcast.id.in_(candidates), Broadcast.status.in_(_ACTIVE), free, ~busy)
+                .order_by(Broadcast.id)
+                .limit(1)
+            ) if candidates else None
+            if bid is None:
+                return None
+            res = await s.execute(
+                update(Broadcast)
+                .where(Broadcast.id == bid, Broadcast.status.in_(_ACTIVE), free, ~busy)
+                .values(status=BroadcastStatus.RUNNING.value, locked_until=now + timedelta(seconds=LEASE))
+            )
+            await s.commit()
+        return bid if res.rowcount == 1 else None
+
+    async def run(self, bid: int):
+        async with SessionLocal() as s:
+            b = await s.get(Broadcast, bid)
+        run = _Run(b, lease=_as_utc(b.locked_until), reply_markup=markup(b.product_id))
+        if b.photo_file_id:
+            run.photo = b.photo_file_id
+        elif b.photo_path and os.path.exists(os.path.join(settings.MEDIA_ROOT, b.photo_path)):
+            run.photo = FSInputFile(os.path.join(settings.MEDIA_ROOT, b.photo_path))
+            run.uploaded = False
+        elif b.kind == "photo":
+            log.warning("broadcast #%s: photo %s is missing, sending text only", b.id, b.photo_path)
+        log.info("broadcast #%s: %s from user %s", b.id, "resumed" if b.cursor else "started", b.cursor)
+
+        keeper = asyncio.create_task(self._keep(run), name=f"broadcast-{bid}-progress")
+        status = None
+        try:
+            while not (self._stopping or run.stopped):
+                async with SessionLocal() as s:
+                    ids = (
+                        await s.scalars(
+                            select(User.id)
+                            .where(User.id > b.cursor, recipients_filter())
+                            .order_by(User.id)
+                            .limit(BATCH_SIZE)
+                        )
+                    ).all()
+                if not ids:
+                    status = BroadcastStatus.DONE.value
+                    break
+                await self._send_batch(run, _Batch(list(ids)))
+        finally:
+            # не cancel(): оборванный посреди сброса keeper оставил бы аренду, о которой мы не знаем
+            run.finished.set()
+            await keeper
+            try:
+                await self._flush(run, final=status)
+            except _LeaseLost:
+                log.warning("broadcast #%s: lease lost, another process took over", bid)
+                return
+        if b.status != BroadcastStatus.RUNNING.value:
+            discard_photo(b)
+            log.info("broadcast #%s %s: sent %s, blocked %s, failed %s", bid, b.status, b.sent, b.blocked, b.failed)
+        await self._progress(b)
+
+    async def _send_batch(self, run: _Run, batch: _Batch):
+        async def worker():
+            while not (self._stopping or run.stopped):
+                i = batch.take()
+                if i is None:
+                    return
+                self._complete(run, batch, i, await self._deliver(run, batch.ids[i]))
+
+        # пока у фото нет file_id — по одному: его выдаст первая успешная отправка
+        while not run.uploaded and not (self._stopping or run.stopped):
+            i = batch.take()
+            if i is None:
+                return
+            self._complete(run, batch, i, await self._deliver(run, batch.ids[i]))
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    def _complete(self, run: _Run, batch: _Batch, i: int, result: Optional[str]):
+        if result is None:
+            return  # остановились посреди отправки — пользователь остаётся за cursor
+        batch.results[i] = result
+        b = run.b
+        while batch.done < len(batch.ids) and batch.results[batch.done] is not None:
+            uid, result = batch.ids[batch.done], batch.results[batch.done]
+            if result == SENT:
+                b.sent += 1
+            elif result == BLOCKED:
+                b.blocked += 1
+                run.blocked_ids.append(uid)
+            else:
+                b.failed += 1
+            b.cursor = uid
+            batch.done += 1
+
+    async def _deliver(self, run: _Run, chat_id: int) -> Optional[str]:
+        attempts = 0
+        while not (self._stopping or run.stopped):
+            await self.bucket.acquire()
+            try:
+                await self._send(run, chat_id)
+            except TelegramRetryAfter as e:
+                self.bucket.pause(e.retry_after)
+                log.warning("broadcast #%s: flood wait %ss", run.b.id, e.retry_after)
+            except TelegramForbiddenError:
+                return BLOCKED
+            except TelegramBadRequest as e:
+                log.warning("broadcast #%s: chat %s: %s", run.b.id, chat_id, e)
+                return FAILED
+            except Exception as e:
+                attempts += 1
+                if attempts >= MAX_ATTEMPTS:
+                    log.error("broadcast #%s: chat %s gave up: %s", run.b.id, chat_id, e)
+                    return FAILED
+                await asyncio.sleep(BACKOFF_BASE ** attempts)
+            else:
+                return SENT
+        return None
+
+    async def _send(self, run: _Run, chat_id: int):
+        b = run.b
+        if run.photo is None:
+            await self.bot.send_message(
+                chat_id, b.text, reply_markup=run.reply_markup, disable_web_page_preview=True
+            )
+            return
+        msg = await self.bot.send_photo(chat_id, run.photo, caption=b.text, reply_markup=run.reply_markup)
+        if not run.uploaded and msg.photo:
+            b.photo_file_id = run.photo = msg.photo[-1].file_id
+            run.uploaded = True
+
+    async def _keep(self, run: _Run):
+        """Раз в секунду — прогресс в БД (заодно продление аренды), реже — сообщение админу."""
+        shown = time.monotonic()
+        while not run.finished.is_set():
+            try:
+                await asyncio.wait_for(run.finished.wait(), FLUSH_INTERVAL)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self._flush(run)
+            except _LeaseLost:
+                log.warning("broadcast #%s: lease lost, stopping", run.b.id)
+                run.stopped = True
+                return
+            except Exception:
+                log.exception("broadcast #%s: progress flush failed", run.b.id)
+                continue
+            if time.monotonic() - shown >= PROGRESS_INTERVAL:
+                shown = time.monotonic()
+                await self._progress(run.b)
+
+    async def _flush(self, run: _Run, final: Optional[str] = None):
+        """Сохраняет cursor и счётчики (абсолютные — повторный сброс безвреден) и продлевает аренду.
+        final — завершить рассылку; при остановке процесса аренда снимается, чтобы продолжить сразу."""
+        b = run.b
+        values = dict(
+            cursor=b.cursor, sent=b.sent, failed=b.failed, blocked=b.blocked, photo_file_id=b.photo_file_id,
+        )
+        lease = _now() + timedelta(seconds=LEASE)
+        if final is not None:
+            # отмена из админ-бота (cancel_active) аренду не снимает — её статус не затираем
+            running = Broadcast.status == BroadcastStatus.RUNNING.value
+            values.update(
+                status=case((running, final), else_=Broadcast.status),
+                finished_at=case((running, _now()), else_=Broadcast.finished_at),
+                locked_until=None,
+            )
+        elif self._stopping or run.stopped:
+            values.update(locked_until=None)
+        else:
+            values.update(locked_until=lease)
+        blocked = list(run.blocked_ids)
+
+        async with SessionLocal() as s:
+            status = (
+                await s.execute(
+                    update(Broadcast)
+                    .where(Broadcast.id == b.id, Broadcast.locked_until == run.lease)
+                    .values(**values)
+                    .returning(Broadcast.status)
+                )
+            ).scalar_one_or_none()
+            if status is None:
+                raise _LeaseLost()
+            if blocked:
+                await s.execute(update(User).where(User.id.in_(blocked)).values(is_blocked=True))
+            await s.commit()
+
+        del run.blocked_ids[:len(blocked)]
+        run.lease = values["locked_until"]
+        b.status = status
+        if status != BroadcastStatus.RUNNING.value:
+            run.stopped = True  # отменили из админ-бота
+
+    async def _progress(self, b: Broadcast):
+        if self.on_progress is None:
+            return
+        try:
+            await self.on_progress(b)
+        except Exception:
+            log.exception("broadcast #%s: progress callback failed", b.id)
@@ -0,0 +1,215 @@
+# server/catalog.py
+import asyncio
+import time
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from server.db import dialect_insert
+from server.models import CatalogClock, Product, ProductImage, ProductTombstone
+
+SORTS = (None, "price_asc", "price_desc")
+
+
+def category_key(name: Optional[str]) -> str:
+    """Категория для сравнения: без пробелов по краям и без учёта регистра
+    (в SQL — lower(trim(category)))."""
+    return (name or "").strip().lower()
+
+
+def _sort_key(sort: Optional[str], item) -> tuple:
+    """Ключ, по возрастанию которого идёт выдача (совпадает с keyset-порядком SQL-пути)."""
+    if sort == "price_asc":
+        return (item.price, item.id)
+    if sort == "price_desc":
+        return (-item.price, -item.id)
+    return (-item.id,)
+
+
+def cursor_key(sort: Optional[str], values: list) -> tuple:
+    """Курсор из /api/products -> ключ в терминах _sort_key."""
+    if sort == "price_asc":
+        return (float(values[0]), int(values[1]))
+    if sort == "price_desc":
+        return (-float(values[0]), -int(values[1]))
+    return (-int(values[0]),)
+
+
+@dataclass
+class _Order:
+    keys: List[tuple]
+    items: List[Any]
+
+
+@dataclass
+class CatalogSnapshot:
+    """Активные товары, уже приведённые к ProductOut, с готовыми индексами."""
+    version: tuple
+    media_base: str
+    by_id: Dict[int, Any]
+    counts: Dict[str, int]
+    # id -> товар, уже закодированный в JSON: ответ склеивается без повторной сериализации
+    raw: Dict[int, bytes] = field(default_factory=dict)
+    # updated_at по товарам и максимум по каталогу — для Last-Modified
+    updated: Dict[int, Optional[datetime]] = field(default_factory=dict)
+    last_modified: Optional[datetime] = None
+    # (категория или "", sort) -> упорядоченный список
+    orders: Dict[Tuple[str, Optional[str]], _Order] = field(default_factory=dict)
+
+    @classmethod
+    def build(
+        cls,
+        version: tuple,
+        media_base: str,
+        rows: List[Product],
+        mapper: Callable[[Product], Any],
+        encoder: Optional[Callable[[Any], bytes]] = None,
+    ) -> "CatalogSnapshot":
+        items = []
+        groups: Dict[str, List[Any]] = {"": items}
+        counts: Dict[str, int] = {}
+        updated: Dict[int, Optional[datetime]] = {}
+        for p in rows:
+            it = mapper(p)
+            items.append(it)
+            updated[p.id] = p.updated_at
+            c = (p.category or "").strip()
+            if not c:
+                continue
+            groups.setdefault(category_key(c), []).append(it)
+            counts[c] = counts.get(c, 0) + 1
+
+        orders = {}
+        for name, group in groups.items():
+            for sort in SORTS:
+                ordered = sorted(group, key=lambda it: _sort_key(sort, it))
+                orders[(name, sort)] = _Order([_sort_key(sort, it) for it in ordered], ordered)
+
+        return cls(
+            version=version,
+            media_base=media_base,
+            by_id={it.id: it for it in items},
+            counts=counts,
+            raw={it.id: encoder(it) for it in items} if encoder is not None else {},
+            updated=updated,
+            last_modified=max((d for d in updated.values() if d is not None), default=None),
+            orders=orders,
+        )
+
+    def page(
+        self,
+        sort: Optional[str],
+        category: Optional[str],
+        after: Optional[tuple],
+        limit: Optional[int],
+    ) -> Tuple[List[Any], bool]:
+        """Срез выдачи после ключа after; второй элемент — есть ли ещё страницы."""
+        order = self.orders.get((category_key(category), sort if sort in SORTS else None))
+        if order is None:
+            return [], False
+
+        start = bisect_right(order.keys, after) if after is not None else 0
+        if not limit:
+            return order.items[start:], False
+        chunk = order.items[start:start + limit + 1]
+        return chunk[:limit], len(chunk) > limit
+
+
+VERSION_CLOCK = 5  # позиция catalog_clock в кортеже catalog_version()
+
+
+async def catalog_version(s: AsyncSession) -> tuple:
+    """Дешёвый штамп версии каталога: один запрос из агрегатов по PK/updated_at.
+
+    Изображения учитываются отдельно: добавление фото в ту же секунду, что и товар,
+    не меняет max(updated_at) на SQLite."""
+    stmt = select(
+        select(func.count(Product.id)).scalar_subquery(),
+        select(func.max(Product.id)).scalar_subquery(),
+        select(func.max(Product.updated_at)).scalar_subquery(),
+        select(func.count(ProductImage.id)).scalar_subquery(),
+        select(func.max(ProductImage.id)).scalar_subquery(),
+        select(CatalogClock.value).where(CatalogClock.id == 1).scalar_subquery(),
+    )
+    return tuple((await s.execute(stmt)).one())
+
+
+async def stamp_changes(s: AsyncSession, product_ids: Iterable[int] = (), removed: Iterable[int] = ()) -> int:
+    """Метит изменённые и удалённые товары следующим значением catalog_clock; зовётся
+    последним перед коммитом. UPDATE держит блокировку строки счётчика до коммита, так что
+    значения достаются транзакциям в порядке коммитов: кто прочитал счётчик N, тот уже видит
+    все товары с change_seq <= N (часы сервера и updated_at так не умеют)."""
+    seq = (
+        await s.execute(
+            update(CatalogClock)
+            .where(CatalogClock.id == 1)
+            .values(value=CatalogClock.value + 1)
+            .returning(CatalogClock.value)
+        )
+    ).scalar_one()
+    ids = list(product_ids)
+    if ids:
+        await s.execute(
+            update(Product).where(Product.id.in_(ids)).values(change_seq=seq),
+            execution_options={"synchronize_session": False},
+        )
+    for pid in removed:
+        tomb = dialect_insert(ProductTombstone).values(product_id=pid, change_seq=seq)
+        await s.execute(tomb.on_conflict_do_update(
+            index_elements=[ProductTombstone.product_id],
+            set_={"deleted_at": func.now(), "change_seq": seq},
+        ))
+    return seq
+
+
+class CatalogCache:
+    """Снимок каталога в памяти процесса.
+
+    Версия каталога проверяется не чаще раза в ttl секунд, снимок пересобирается
+    только если она изменилась (каталог меняет только админ-бот)."""
+
+    def __init__(self, ttl: float, on_rebuild: Optional[Callable[[], None]] = None):
+        self.ttl = ttl
+        self.on_rebuild = on_rebuild  # каталог изменился — сбросить производные кэши
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._checked_at = 0.0
+
+    async def get(
+        self,
+        s: AsyncSession,
+        media_base: str,
+        mapper: Callable[[Product], Any],
+        encoder: Optional[Callable[[Any], bytes]] = None,
+    ) -> CatalogSnapshot:
+        snap = self._snapshot
+        if snap is not None and snap.media_base == media_base and time.monotonic() - self._checked_at < self.ttl:
+            return snap
+
+        async with self._lock:
+            snap = self._snapshot
+            if snap is not None and snap.media_base == media_base and time.monotonic() - self._checked_at < self.ttl:
+                return snap
+
+            version = await catalog_version(s)
+            if snap is None or snap.version != version or snap.media_base != media_base:
+                stmt = (
+                    select(Product)
+                    .options(selectinload(Product.images))
+                    .where(Product.is_active == True)
+                )
+                rows = (await s.execute(stmt)).scalars().all()
+                if self.on_rebuild is not None:
+                    self.on_rebuild()
+                snap = CatalogSnapshot.build(version, media_base, rows, mapper, encoder)
+                self._snapshot = snap
+            self._checked_at = time.monotonic()
+            return snap
@@ -1,16 +1,64 @@
 # server/db.py
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import declarative_base
 from config import settings
 
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    future=True,
-    pool_pre_ping=True,
-)
+
+def _engine_options(url: str) -> dict:
+    """Параметры пула под бэкенд; профили — в readme."""
+    u = make_url(url)
+    is_sqlite = u.get_backend_name() == "sqlite"
+    pre_ping = settings.DB_POOL_PRE_PING.lower()
+    opts = {
+        "future": True,
+        # "auto": пингуем только сетевую БД; локальный файл SQLite не «отваливается»
+        "pool_pre_ping": (not is_sqlite) if pre_ping == "auto" else pre_ping in ("1", "true", "yes"),
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    }
+    if not (is_sqlite and u.database in (None, "", ":memory:")):
+        opts["pool_size"] = settings.DB_POOL_SIZE
+        opts["max_overflow"] = settings.DB_MAX_OVERFLOW
+    if u.drivername == "postgresql+asyncpg":
+        # 0 — если между приложением и Postgres стоит pgbouncer в режиме transaction
+        opts["connect_args"] = {"statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+    return opts
+
+
+engine = create_async_engine(settings.DATABASE_URL, **_engine_options(settings.DATABASE_URL))
 SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 Base = declarative_base()
 
+
+def _lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL: читатели API не ждут записей админ-бота; synchronous=NORMAL безопасен в WAL.
+    Встроенный lower() SQLite понимает только ASCII — подменяем питоновским, как в Postgres."""
+    if engine.dialect.name != "sqlite":
+        return
+    dbapi_connection.create_function("lower", 1, _lower, deterministic=True)
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT)}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+    cursor.execute(f"PRAGMA cache_size={int(settings.SQLITE_CACHE_SIZE)}")
+    cursor.close()
+
+
 async def get_session() -> AsyncSession:
     async with SessionLocal() as s:
         yield s
+
+
+def dialect_insert(table):
+    """INSERT с on_conflict_do_update/do_nothing для текущей БД (Postgres или SQLite)."""
+    if engine.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
@@ -0,0 +1,91 @@
+# server/events.py
+"""Буфер пользовательских событий мини-аппа.
+
+/api/webapp-opened только кладёт событие в память; фоновая задача сбрасывает буфер
+многострочными INSERT по размеру или по таймеру и обязательно — при остановке сервера.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert
+
+from server.db import SessionLocal
+from server.models import UserLog, UserLogAction
+from server.users import upsert_users
+
+log = logging.getLogger(__name__)
+
+# сколько событий держим, если БД недоступна; дальше старые отбрасываются
+MAX_PENDING = 50_000
+# строк в одном INSERT (лимит параметров SQLite — 32766)
+CHUNK = 1000
+
+
+class EventBuffer:
+    def __init__(self, flush_size: int, flush_interval: float):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._users: Dict[int, dict] = {}  # последние данные пользователя, по id
+        self._logs: List[dict] = []
+        self._kick = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def webapp_opened(self, user_id: int, username: Optional[str], name: Optional[str]):
+        """Синхронно и без обращения к БД — вызывается прямо из обработчика запроса."""
+        self._users[user_id] = {"id": user_id, "username": username, "name": name}
+        self._logs.append(
+            {
+                "user_id": user_id,
+                "action": UserLogAction.WEB_APP_OPENED.value,
+                "datetime": datetime.now(timezone.utc),
+            }
+        )
+        if len(self._logs) > MAX_PENDING:
+            del self._logs[: len(self._logs) - MAX_PENDING]
+        if len(self._logs) >= self.flush_size:
+            self._kick.set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="event-buffer")
+
+    async def stop(self):
+        self._stopping = True
+        self._kick.set()
+        if self._task is not None:
+            await self._task
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._kick.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._kick.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            users, logs = self._users, self._logs
+            if not users and not logs:
+                return
+            self._users, self._logs = {}, []
+            try:
+                await self._write(users, logs)
+            except Exception:
+                log.exception("event flush failed, %d events re-queued", len(logs))
+                # вернуть в начало очереди, сохранив более свежие данные пользователей
+                users.update(self._users)
+                self._users = users
+                self._logs = (logs + self._logs)[-MAX_PENDING:]
+
+    async def _write(self, users: Dict[int, dict], logs: List[dict]):
+        async with SessionLocal() as s:
+            await upsert_users(s, users.values())
+            for i in range(0, len(logs), CHUNK):
+                await s.execute(insert(UserLog).values(logs[i:i + CHUNK]))
+            await s.commit()
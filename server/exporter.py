@@ -0,0 +1,84 @@
+# server/exporter.py
+"""Выгрузка каталога в CSV/XLSX для админ-бота.
+
+Товары читаются серверным курсором (stream + yield_per) и пишутся в файл построчно —
+память не растёт с размером каталога. Колонки совпадают с форматом импорта
+(server/importer.py), так что выгрузку можно поправить и загрузить обратно.
+"""
+import csv
+import os
+from typing import Optional
+from urllib.parse import urljoin
+
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from config import settings
+from server.db import SessionLocal
+from server.models import Product
+
+CHUNK = 1000
+HEADER = ["id", "sku", "title", "price", "subtitle", "status", "category", "is_active", "images"]
+FORMATS = ("csv", "xlsx")
+
+
+def _media_base() -> Optional[str]:
+    """Публичный адрес /media/ — фото в выгрузке ссылками, пригодными для импорта."""
+    if not settings.WEBAPP_URL:
+        return None
+    return urljoin(settings.WEBAPP_URL, "/media/")
+
+
+def _row(p: Product, media_base: Optional[str]) -> list:
+    paths = [i.path for i in sorted(p.images, key=lambda i: (i.sort_order, i.id))]
+    if media_base:
+        paths = [urljoin(media_base, path) for path in paths]
+    return [
+        p.id, p.sku or "", p.title, p.price, p.subtitle or "", p.status or "",
+        p.category or "", 1 if p.is_active else 0, " ".join(paths),
+    ]
+
+
+async def _rows():
+    media_base = _media_base()
+    stmt = (
+        select(Product)
+        .options(selectinload(Product.images))
+        .order_by(Product.id)
+        .execution_options(yield_per=CHUNK)
+    )
+    async with SessionLocal() as s:
+        result = await s.stream(stmt)
+        async for chunk in result.scalars().partitions():
+            # identity map слабая: записанные товары освобождаются вместе с пачкой
+            for p in chunk:
+                yield _row(p, media_base)
+
+
+async def export_catalog(path: str) -> int:
+    """Пишет каталог в path (.csv или .xlsx); возвращает число товаров."""
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    if ext not in FORMATS:
+        raise ValueError("поддерживаются .csv и .xlsx")
+
+    count = 0
+    if ext == "csv":
+        # utf-8-sig и «;» — чтобы Excel открывал кириллицу и колонки без мастера импорта
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            w = csv.writer(f, delimiter=";")
+            w.writerow(HEADER)
+            async for row in _rows():
+                w.writerow(row)
+                count += 1
+        return count
+
+    from openpyxl import Workbook  # только для XLSX
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Каталог")
+    ws.append(HEADER)
+    async for row in _rows():
+        ws.append(row)
+        count += 1
+    wb.save(path)
+    return count
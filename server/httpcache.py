@@ -0,0 +1,86 @@
+# server/httpcache.py
+"""Валидаторы HTTP-кэша (ETag / Last-Modified) для ответов каталога."""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional
+
+from fastapi import Request, Response
+from fastapi.staticfiles import StaticFiles
+
+from server.media import stat_fingerprint
+
+# браузер хранит ответ, но перед использованием всегда перепроверяет его
+CACHE_CONTROL = "no-cache"
+# URL с актуальной версией (?v=) никогда не меняет содержимое — перепроверять незачем
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def make_etag(*parts) -> str:
+    """Сильный ETag из версии каталога и всего, от чего зависит представление."""
+    digest = hashlib.sha256("\x1f".join(map(str, parts)).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def _utc(dt: datetime) -> datetime:
+    # SQLite отдаёт наивные datetime (CURRENT_TIMESTAMP — это UTC)
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def validators(etag: str, last_modified: Optional[datetime] = None, vary: Optional[str] = None) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if vary:
+        headers["Vary"] = vary
+    if isinstance(last_modified, datetime):
+        headers["Last-Modified"] = format_datetime(_utc(last_modified).replace(microsecond=0), usegmt=True)
+    return headers
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """If-None-Match приоритетнее If-Modified-Since (RFC 9110, 13.2.2)."""
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        tags = {t.strip() for t in inm.split(",")}
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+    ims = request.headers.get("if-modified-since")
+    if ims and isinstance(last_modified, datetime):
+        try:
+            since = parsedate_to_datetime(ims)
+        except (TypeError, ValueError):
+            return False
+        if since is None:
+            return False
+        return _utc(last_modified).replace(microsecond=0) <= _utc(since)
+    return False
+
+
+def conditional(
+    request: Request,
+    response: Response,
+    etag: str,
+    last_modified: Optional[datetime] = None,
+    vary: Optional[str] = None,
+) -> Optional[Response]:
+    """304, если клиентская копия актуальна; иначе проставляет валидаторы в response и возвращает None.
+    vary — заголовки запроса, от которых зависит ETag: уходит и в 304 (RFC 9110, 15.4.5)."""
+    headers = validators(etag, last_modified, vary)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+class MediaStaticFiles(StaticFiles):
+    """/media: ETag, Last-Modified и Range — от StaticFiles. Навсегда кэшируются только ссылки,
+    чей ?v= совпадает с версией файла (их выдаёт API); без версии или со старой — перепроверяются,
+    иначе кэш запомнил бы под этим URL чужое содержимое."""
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        version = stat_fingerprint(stat_result).encode()
+        fresh = any(part == b"v=" + version for part in scope.get("query_string", b"").split(b"&"))
+        response.headers["Cache-Control"] = IMMUTABLE if fresh else CACHE_CONTROL
+        return response
@@ -0,0 +1,213 @@
+# server/images.py
+"""Производные изображений товаров: превью фиксированной ширины в JPEG, WebP и AVIF.
+
+Файлы лежат рядом с оригиналом: <stem>_w320.webp, <stem>_w640.avif, ...
+Обработка идёт в пуле процессов, чтобы не блокировать event loop бота.
+
+Досоздать превью для уже загруженных фото:
+    python -m server.images [--force] [--workers N]
+Товары с новыми превью помечаются изменёнными — клиенты получат ссылки с новой версией.
+"""
+import argparse
+import asyncio
+import glob
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+
+log = logging.getLogger(__name__)
+
+WIDTHS = (640, 320)  # крупные первыми: наличие самого маленького = формат готов целиком
+THUMB_WIDTH = 320
+
+# (расширение, MIME, параметры сохранения Pillow)
+FORMATS = (
+    ("avif", "image/avif", {"quality": 55}),
+    ("webp", "image/webp", {"quality": 78, "method": 4}),
+    ("jpg", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+)
+
+_VARIANT_RE = re.compile(r"_w\d+\.(avif|webp|jpg)$")
+
+_executor: Optional[Executor] = None
+
+
+def variant_path(path: str, width: int, ext: str) -> str:
+    """Путь производной (работает и с абсолютными, и с относительными путями)."""
+    stem, _ = os.path.splitext(path)
+    return f"{stem}_w{width}.{ext}"
+
+
+def is_variant(path: str) -> bool:
+    return bool(_VARIANT_RE.search(path))
+
+
+def make_variants(abs_path: str, force: bool = False) -> List[str]:
+    """Создаёт производные для одного файла; выполняется в дочернем процессе."""
+    from PIL import Image, ImageOps, features
+
+    done = []
+    with Image.open(abs_path) as src:
+        im = ImageOps.exif_transpose(src).convert("RGB")
+
+    for ext, _, params in FORMATS:
+        if ext == "avif" and not features.check("avif"):
+            continue
+        for width in WIDTHS:
+            if any(im.width <= w < width for w in WIDTHS):
+                continue  # вышел бы тот же файл, что и для меньшей ширины
+            dest = variant_path(abs_path, width, ext)
+            if not force and os.path.exists(dest):
+                continue
+            if im.width > width:
+                resized = im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+            else:
+                resized = im
+            # файл может быть общим (server/media.py): два воркера не должны делить .tmp
+            tmp = f"{dest}.{os.getpid()}.tmp"
+            resized.save(tmp, format="JPEG" if ext == "jpg" else ext.upper(), **params)
+            os.replace(tmp, dest)
+            done.append(dest)
+    return done
+
+
+def remove_variants(abs_path: str):
+    for ext, _, _ in FORMATS:
+        for width in WIDTHS:
+            try:
+                os.remove(variant_path(abs_path, width, ext))
+            except FileNotFoundError:
+                pass
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        # spawn: форк процесса с запущенным event loop и потоками aiohttp небезопасен
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+async def build_variants(abs_path: str, force: bool = False) -> List[str]:
+    """Производные для загруженного фото; ошибки не валят загрузку — остаётся оригинал."""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_executor(), make_variants, abs_path, force)
+    except Exception:
+        log.exception("image variants failed for %s", abs_path)
+        return []
+
+
+def source_width(abs_path: str) -> Optional[int]:
+    """Ширина оригинала с учётом EXIF-поворота (как в make_variants); читается только заголовок."""
+    try:
+        from PIL import Image
+    except ImportError:  # Pillow нужен только там, где генерируются превью
+        return None
+    try:
+        with Image.open(abs_path) as im:
+            width, height = im.size
+            if im.getexif().get(0x0112) in (5, 6, 7, 8):  # повёрнут на 90°
+                width = height
+    except OSError:
+        return None
+    return width
+
+
+def available_variants(media_root: str, relpath: str) -> Dict[str, List[Tuple[int, str]]]:
+    """Готовые производные файла: {ext: [(реальная ширина, relpath производной)] по возрастанию}.
+    Узкий оригинал не растягивается, поэтому одинаковые по факту ширины схлопываются в одну."""
+    out = {}
+    abs_path = os.path.join(media_root, relpath)
+    width = None
+    for ext, _, _ in FORMATS:
+        if not os.path.exists(variant_path(abs_path, THUMB_WIDTH, ext)):
+            continue
+        if width is None:
+            width = source_width(abs_path) or 0
+        real = {}
+        for w in sorted(WIDTHS):
+            path = variant_path(relpath, w, ext)
+            if os.path.exists(os.path.join(media_root, path)):
+                real.setdefault(min(w, width) if width else w, path)
+        out[ext] = sorted(real.items())
+    return out
+
+
+def mime_type(ext: str) -> str:
+    return next(mime for e, mime, _ in FORMATS if e == ext)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Досоздать превью для media/products/* и media/blobs/*")
+    parser.add_argument("--media-root", default=settings.MEDIA_ROOT)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--force", action="store_true", help="пересоздать существующие")
+    args = parser.parse_args()
+
+    files = [
+        p
+        for top in ("products", "blobs")
+        for p in glob.glob(os.path.join(args.media_root, top, "**", "*.*"), recursive=True)
+        # blobs/tmp — недокачанные загрузки; сверяем путь внутри media_root, он сам может лежать в /tmp
+        if not is_variant(p) and not p.endswith(".tmp")
+        and "tmp" not in os.path.relpath(p, args.media_root).split(os.sep)[:-1]
+    ]
+    log.info("originals: %d", len(files))
+
+    made = failed = 0
+    changed = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(make_variants, p, args.force): p for p in files}
+        for fut, path in futures.items():
+            try:
+                written = fut.result()
+            except Exception as e:
+                failed += 1
+                log.warning("%s: %s", path, e)
+                continue
+            made += len(written)
+            if written:
+                changed.append(os.path.relpath(path, args.media_root).replace(os.sep, "/"))
+    log.info("variants written: %d, failed originals: %d", made, failed)
+    if changed:
+        log.info("products marked changed: %d", asyncio.run(_touch_products(changed)))
+
+
+async def _touch_products(relpaths: List[str]) -> int:
+    """Сдвигает версию каталога для товаров с этими фото: в ссылках API новые ?v= и srcset."""
+    # БД нужна только CLI — модуль импортируют сервер и бот, где она уже поднята
+    from sqlalchemy import func, select, update
+
+    from server.catalog import stamp_changes
+    from server.db import SessionLocal, engine
+    from server.models import Product, ProductImage
+
+    touched = 0
+    try:
+        for i in range(0, len(relpaths), 500):
+            async with SessionLocal() as s:
+                stmt = select(ProductImage.product_id).where(ProductImage.path.in_(relpaths[i:i + 500])).distinct()
+                ids = list((await s.execute(stmt)).scalars())
+                if not ids:
+                    continue
+                await s.execute(update(Product).where(Product.id.in_(ids)).values(updated_at=func.now()))
+                await stamp_changes(s, ids)
+                await s.commit()
+                touched += len(ids)
+    finally:
+        await engine.dispose()
+    return touched
+
+
+if __name__ == "__main__":
+    main()
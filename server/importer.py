@@ -0,0 +1,416 @@
+# server/importer.py
+"""Массовый импорт каталога из CSV/XLSX (прайс поставщика).
+
+Файл читается потоково (csv.reader / openpyxl read_only), строки идут пачками по BATCH
+в многострочный INSERT ... ON CONFLICT (sku) DO UPDATE. Строки с колонкой id (файл из
+/export) обновляют товар по id — так правятся и товары из бота, у которых артикула нет.
+Фото по ссылкам (в том числе zip-архивы с фото) качаются только для товаров, у которых фото ещё нет, — повторный
+импорт того же прайса обновляет цены/статусы и ничего не скачивает заново. Одинаковые
+фото у разных товаров хранятся одним файлом (server/media.py).
+"""
+import asyncio
+import csv
+import io
+import logging
+import os
+import re
+import zipfile
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server import media
+from server.catalog import stamp_changes
+from server.db import SessionLocal, dialect_insert
+from server.models import Product, ProductImage
+
+log = logging.getLogger(__name__)
+
+BATCH = 500
+MAX_IMAGE_BYTES = 15 * 1024 * 1024
+MAX_ARCHIVE_BYTES = 100 * 1024 * 1024
+IMAGE_CONCURRENCY = 8
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+
+# заголовок в файле (в нижнем регистре) -> поле
+COLUMNS = {
+    "id": "id",
+    "sku": "sku", "артикул": "sku", "код": "sku", "article": "sku",
+    "title": "title", "название": "title", "наименование": "title", "name": "title",
+    "price": "price", "цена": "price",
+    "subtitle": "subtitle", "описание": "subtitle", "подзаголовок": "subtitle", "description": "subtitle",
+    "status": "status", "статус": "status", "наличие": "status",
+    "category": "category", "категория": "category",
+    "is_active": "is_active", "активен": "is_active", "active": "is_active",
+    "images": "images", "image": "images", "фото": "images", "изображения": "images", "image_url": "images",
+}
+REQUIRED = ("title", "price")  # и sku или id
+
+_URL_SPLIT = re.compile(r"[\s,;|]+")
+
+
+class ImportFormatError(ValueError):
+    """Файл не похож на прайс: нет нужных колонок, неизвестный формат."""
+
+
+@dataclass
+class ImportStats:
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    skipped: int = 0
+    images: int = 0
+    image_errors: int = 0
+    errors: List[str] = field(default_factory=list)
+
+    def error(self, msg: str):
+        self.skipped += 1
+        if len(self.errors) < 10:
+            self.errors.append(msg)
+
+
+# ---- чтение файла ----
+def _iter_csv(path: str) -> Iterator[list]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        sample = f.read(64 * 1024)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=";,\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(f, dialect)
+
+
+def _iter_xlsx(path: str) -> Iterator[list]:
+    from openpyxl import load_workbook  # только для XLSX
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in wb.active.iter_rows(values_only=True):
+            yield ["" if v is None else v for v in row]
+    finally:
+        wb.close()
+
+
+def iter_records(path: str) -> Iterator[Tuple[int, Dict[str, object]]]:
+    """(номер строки в файле, {поле: значение}) — без загрузки файла целиком."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        rows = _iter_csv(path)
+    elif ext in (".xlsx", ".xlsm"):
+        rows = _iter_xlsx(path)
+    else:
+        raise ImportFormatError("поддерживаются .csv и .xlsx")
+
+    header = next(rows, None) or []
+    fields = [COLUMNS.get(str(h).strip().lower()) for h in header]
+    missing = [f for f in REQUIRED if f not in fields]
+    if "sku" not in fields and "id" not in fields:
+        missing.append("sku")
+    if missing:
+        raise ImportFormatError("нет колонок: " + ", ".join(missing))
+
+    for n, row in enumerate(rows, 2):
+        rec = {f: v for f, v in zip(fields, row) if f}
+        if any(str(v).strip() for v in rec.values()):
+            yield n, rec
+
+
+def _parse_price(v) -> float:
+    if isinstance(v, (int, float)):
+        return float(v)
+    s = str(v).replace(" ", "").replace(" ", "").replace("₽", "").replace(",", ".")
+    return float(s)
+
+
+def _parse_bool(v) -> bool:
+    if isinstance(v, bool):
+        return v
+    return str(v).strip().lower() not in ("0", "нет", "no", "false", "n", "-")
+
+
+def normalize(n: int, rec: Dict[str, object], stats: ImportStats) -> Optional[dict]:
+    sku = str(rec.get("sku") or "").strip()
+    title = str(rec.get("title") or "").strip()
+    raw_id = str(rec.get("id") or "").strip()
+    try:
+        pid = int(float(raw_id)) if raw_id else None  # из XLSX id приходит числом
+    except ValueError:
+        stats.error(f"строка {n}: id «{raw_id}»")
+        return None
+    if not (sku or pid) or not title:
+        stats.error(f"строка {n}: пустой артикул или название")
+        return None
+    try:
+        price = _parse_price(rec.get("price"))
+    except (TypeError, ValueError):
+        stats.error(f"строка {n}: цена «{rec.get('price')}»")
+        return None
+
+    row = {"title": title[:255], "price": price}
+    if sku:
+        row["sku"] = sku[:64]
+    if "subtitle" in rec:
+        row["subtitle"] = str(rec["subtitle"] or "").strip()[:255]
+    if "status" in rec:
+        row["status"] = str(rec["status"] or "").strip()[:64] or "В наличии"
+    if "category" in rec:
+        row["category"] = str(rec["category"] or "").strip()[:256]
+    if "is_active" in rec and str(rec["is_active"]).strip():
+        row["is_active"] = _parse_bool(rec["is_active"])
+    urls = [u for u in _URL_SPLIT.split(str(rec.get("images") or "")) if u.startswith(("http://", "https://"))]
+    return {"n": n, "id": pid, "row": row, "images": urls}
+
+
+def _batches(records: Iterator[Tuple[int, dict]], stats: ImportStats) -> Iterator[List[dict]]:
+    batch: Dict[Tuple[str, Any], dict] = {}
+    for n, rec in records:
+        stats.rows += 1
+        item = normalize(n, rec, stats)
+        if item is None:
+            continue
+        # повтор товара в пачке — побеждает последняя строка
+        key = ("id", item["id"]) if item["id"] else ("sku", item["row"]["sku"])
+        batch[key] = item
+        if len(batch) >= BATCH:
+            yield list(batch.values())
+            batch = {}
+    if batch:
+        yield list(batch.values())
+
+
+# ---- запись ----
+async def upsert_batch(s: AsyncSession, items: List[dict], stats: ImportStats) -> List[dict]:
+    """Строки с id — UPDATE по id, остальные — один INSERT ... ON CONFLICT (sku).
+    Проставляет item["id"] и возвращает записанные строки."""
+    by_id = await _update_by_id(s, [it for it in items if it["id"]], stats)
+    # строки с удалённым id могли совпасть по артикулу со строками без id: один INSERT
+    # ... ON CONFLICT не обновит строку дважды — побеждает последняя в файле
+    by_sku: Dict[str, dict] = {}
+    for it in sorted([it for it in items if not it["id"]] + by_id.pop(None, []), key=lambda it: it["n"]):
+        by_sku[it["row"]["sku"]] = it
+    return by_id.get("ok", []) + await _upsert_by_sku(s, list(by_sku.values()), stats)
+
+
+async def _update_by_id(s: AsyncSession, items: List[dict], stats: ImportStats) -> Dict[Optional[str], List[dict]]:
+    """{"ok": обновлённые, None: товара с таким id нет, но есть артикул — пойдут по нему}."""
+    out: Dict[Optional[str], List[dict]] = {"ok": [], None: []}
+    if not items:
+        return out
+    known = set((await s.execute(select(Product.id).where(Product.id.in_([it["id"] for it in items])))).scalars())
+    skus = [it["row"]["sku"] for it in items if "sku" in it["row"]]
+    owners = dict((await s.execute(select(Product.sku, Product.id).where(Product.sku.in_(skus)))).all()) if skus else {}
+
+    rows = []
+    claimed: Dict[str, int] = {}  # артикул -> товар, которому его уже отдала эта пачка
+    for it in items:
+        sku = it["row"].get("sku")
+        if it["id"] not in known:
+            if sku:
+                it["id"] = None  # товар удалён — артикул решит, создать или обновить
+                out[None].append(it)
+            else:
+                stats.error(f"строка {it['n']}: товара #{it['id']} нет")
+            continue
+        owner = owners.get(sku, claimed.get(sku, it["id"])) if sku else it["id"]
+        if owner != it["id"]:
+            stats.error(f"строка {it['n']}: артикул {sku} уже у товара #{owner}")
+            continue
+        if sku:
+            claimed[sku] = it["id"]
+        rows.append({"id": it["id"], **it["row"]})  # updated_at проставит onupdate
+        out["ok"].append(it)
+    if rows:
+        # строки с разным набором колонок SQLAlchemy сам разобьёт на группы executemany
+        await s.execute(update(Product), rows)
+    stats.updated += len(rows)
+    return out
+
+
+async def _upsert_by_sku(s: AsyncSession, items: List[dict], stats: ImportStats) -> List[dict]:
+    if not items:
+        return []
+    skus = [it["row"]["sku"] for it in items]
+    existing = set((await s.execute(select(Product.sku).where(Product.sku.in_(skus)))).scalars())
+
+    # в одном многострочном INSERT у всех строк должен быть одинаковый набор колонок
+    keys = sorted({k for it in items for k in it["row"]})
+    defaults = {"subtitle": "", "status": "В наличии", "category": "", "is_active": True}
+    rows = [{k: it["row"].get(k, defaults.get(k)) for k in keys} for it in items]
+
+    stmt = dialect_insert(Product).values(rows)
+    set_ = {k: stmt.excluded[k] for k in keys if k != "sku"}
+    set_["updated_at"] = func.now()  # onupdate ORM на ON CONFLICT не срабатывает
+    stmt = stmt.on_conflict_do_update(index_elements=[Product.sku], set_=set_).returning(Product.sku, Product.id)
+    ids = {sku: pid for sku, pid in (await s.execute(stmt)).all()}
+    for it in items:
+        it["id"] = ids.get(it["row"]["sku"])
+
+    stats.updated += len(existing)
+    stats.created += len(items) - len(existing)
+    return items
+
+
+def _save(data: bytes, ext: str) -> Tuple[str, str]:
+    dest = media.tmp_path(ext)
+    with open(dest, "wb") as f:
+        f.write(data)
+    return dest, ext
+
+
+async def _download(client, url: str, limit: int) -> Tuple[bytes, str]:
+    async with client.stream("GET", url) as r:
+        r.raise_for_status()
+        buf = bytearray()
+        async for chunk in r.aiter_bytes():
+            buf += chunk
+            if len(buf) > limit:
+                raise ValueError("файл слишком большой")
+        return bytes(buf), r.headers.get("content-type", "")
+
+
+def _image_ext(url: str, content_type: str) -> str:
+    ext = os.path.splitext(url.split("?", 1)[0])[1].lower()
+    if ext in IMAGE_EXTS:
+        return ".jpg" if ext == ".jpeg" else ext
+    return {"image/png": ".png", "image/webp": ".webp"}.get(content_type.split(";")[0].strip(), ".jpg")
+
+
+def _unpack_images(zf: zipfile.ZipFile) -> List[Tuple[str, str]]:
+    """Фото из архива. Размеры сверяются до распаковки: лимит на скачивание
+    не спасает от zip-бомбы (100 МБ архива могут развернуться в гигабайты)."""
+    saved = []
+    total = 0
+    try:
+        for info in sorted(zf.infolist(), key=lambda i: i.filename):
+            ext = os.path.splitext(info.filename)[1].lower()
+            if info.is_dir() or ext not in IMAGE_EXTS or info.filename.startswith("__MACOSX/"):
+                continue
+            total += info.file_size
+            if info.file_size > MAX_IMAGE_BYTES or total > MAX_ARCHIVE_BYTES:
+                raise ValueError(f"{info.filename}: файл в архиве слишком большой")
+            with zf.open(info) as f:
+                data = f.read(MAX_IMAGE_BYTES + 1)  # file_size в заголовке может врать
+            if len(data) > MAX_IMAGE_BYTES:
+                raise ValueError(f"{info.filename}: файл в архиве слишком большой")
+            saved.append(_save(data, ".jpg" if ext == ".jpeg" else ext))
+    except BaseException:
+        for tmp, _ in saved:
+            os.remove(tmp)
+        raise
+    return saved
+
+
+async def _fetch_images(client, urls: List[str]) -> List[Tuple[str, str]]:
+    """Скачивает фото товара (zip — распаковывает), возвращает (временный файл, расширение) по порядку."""
+    saved = []
+    try:
+        for url in urls:
+            if url.split("?", 1)[0].lower().endswith(".zip"):
+                data, _ = await _download(client, url, MAX_ARCHIVE_BYTES)
+                with zipfile.ZipFile(io.BytesIO(data)) as zf:
+                    saved += _unpack_images(zf)
+            else:
+                data, ctype = await _download(client, url, MAX_IMAGE_BYTES)
+                saved.append(_save(data, _image_ext(url, ctype)))
+    except BaseException:
+        for tmp, _ in saved:
+            os.remove(tmp)
+        raise
+    return saved
+
+
+async def images_todo(s: AsyncSession, items: List[dict]) -> Dict[int, List[str]]:
+    """{id товара: ссылки} — фото только для товаров, у которых их ещё нет."""
+    wanted = {it["id"]: it["images"] for it in items if it["images"] and it["id"]}
+    if not wanted:
+        return {}
+    has_images = set(
+        (await s.execute(select(ProductImage.product_id).where(ProductImage.product_id.in_(wanted)).distinct())).scalars()
+    )
+    return {pid: urls for pid, urls in wanted.items() if pid not in has_images}
+
+
+async def import_images(todo: Dict[int, List[str]], stats: ImportStats):
+    """Ссылки качаются параллельно и кладутся в хранилище без БД; транзакция — только
+    на запись ссылок: скачивание (до 20 с на файл) не держит блокировку записи SQLite
+    и строки товаров."""
+    import httpx
+
+    sem = asyncio.Semaphore(IMAGE_CONCURRENCY)
+    tmps: List[str] = []  # скачанные файлы: после settle() их уже нет
+    placed: Set[str] = set()  # выложенные put_file() blob'ы — собрать при откате
+
+    async def one(client, pid, urls):
+        async with sem:
+            try:
+                files = await _fetch_images(client, urls)
+            except Exception as e:
+                stats.image_errors += 1
+                if len(stats.errors) < 10:
+                    stats.errors.append(f"фото товара #{pid}: {(str(e).splitlines() or [type(e).__name__])[0]}")
+                return pid, []
+            # в хранилище (повтор по содержимому — тот же blob) и превью, без БД
+            tmps.extend(tmp for tmp, _ in files)
+            put = []
+            for tmp, ext in files:
+                digest, relpath, size = await media.put_file(tmp, ext)
+                placed.add(relpath)
+                put.append((tmp, digest, relpath, size))
+            return pid, put
+
+    try:
+        async with httpx.AsyncClient(timeout=20, follow_redirects=True) as client:
+            results = await asyncio.gather(*(one(client, pid, urls) for pid, urls in todo.items()))
+
+        async with SessionLocal() as s:
+            rows = []
+            for pid, blobs in results:
+                for i, (tmp, digest, relpath, size) in enumerate(blobs):
+                    blob = await media.acquire(s, digest, relpath, size)
+                    await media.settle(tmp, blob)
+                    placed.add(blob.path)
+                    rows.append({"product_id": pid, "path": blob.path, "sort_order": i, "blob_hash": digest})
+            if not rows:
+                return
+            pids = {r["product_id"] for r in rows}
+            await s.execute(insert(ProductImage), rows)
+            await s.execute(update(Product).where(Product.id.in_(pids)).values(updated_at=func.now()))
+            await stamp_changes(s, pids)
+            await s.commit()
+        stats.images += len(rows)
+    except BaseException:
+        # запись откатилась: файлы, которые успели выложить, без ссылок не нужны
+        for tmp in tmps:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        await media.collect(placed)
+        raise
+
+
+async def import_file(
+    path: str,
+    with_images: bool = True,
+    on_progress: Optional[Callable[[ImportStats], Awaitable[None]]] = None,
+) -> ImportStats:
+    """Импорт прайса; каждая пачка коммитится отдельно, прогресс — после каждой."""
+    stats = ImportStats()
+    batches = _batches(iter_records(path), stats)
+    while True:
+        # разбор файла (openpyxl особенно) — в потоке, чтобы не держать event loop
+        items = await asyncio.to_thread(next, batches, None)
+        if items is None:
+            break
+        async with SessionLocal() as s:
+            written = await upsert_batch(s, items, stats)
+            todo = await images_todo(s, written) if with_images else {}
+            await stamp_changes(s, [it["id"] for it in written])
+            await s.commit()
+        # фото — после коммита пачки, своей короткой транзакцией
+        if todo:
+            await import_images(todo, stats)
+        if on_progress is not None:
+            await on_progress(stats)
+    return stats
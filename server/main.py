@@ -1,26 +1,69 @@
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from typing import List, Optional, Dict
-import json, hmac, hashlib, urllib.parse
-from bot.bot import get_user, save_user
-from fastapi import FastAPI, Depends, Request, HTTPException
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, Field
+from urllib.parse import quote
+import base64, json
+from fastapi import FastAPI, Depends, Request, Response, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, text
+from sqlalchemy import select, text, func, tuple_
 from sqlalchemy.orm import selectinload
 
-from aiogram import Bot
-from aiogram.client.default import DefaultBotProperties
-from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError
-
 from config import settings
-from server.db import SessionLocal, get_session
-from server.models import Product, User, UserLog, UserLogAction
+from server.auth import InitData, InitDataVerifier
+from server import metrics
+from server.catalog import VERSION_CLOCK, CatalogCache, catalog_version, category_key, cursor_key
+from server.db import SessionLocal, engine, get_session
+from server.events import EventBuffer
+from server.httpcache import MediaStaticFiles, conditional, make_etag
+from server import media
+from server.images import mime_type
+from server.models import CatalogClock, Order, OrderItem, OutboxMessage, Product, ProductTombstone
+from server.outbox import OutboxWorker
+from server.search import apply_search
+from server.serialize import FastJSONResponse, dumps, encode_model, json_array
+from server.telegram import create_bot
+from server.webhooks import SECRET_HEADER, Webhooks
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # один Bot (и один пул соединений к Telegram) на весь процесс
+    app.state.bot = create_bot(settings.BOT_TOKEN)
+    app.state.outbox = OutboxWorker(app.state.bot)
+    if settings.OUTBOX_WORKER:
+        app.state.outbox.start()
+    app.state.events = EventBuffer(settings.EVENTS_FLUSH_SIZE, settings.EVENTS_FLUSH_INTERVAL)
+    app.state.events.start()
+    app.state.webhooks = Webhooks()
+    try:
+        if settings.BOT_MODE == "webhook":
+            await app.state.webhooks.start()
+        yield
+    finally:
+        await app.state.webhooks.stop()
+        await app.state.events.stop()
+        await app.state.outbox.stop()
+        await app.state.bot.session.close()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# ---- метрики: латентность по маршрутам, SQL на запрос, пул БД (/metrics) ----
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engine(engine)
 
-app = FastAPI()
 
 # ---- статика ----
 #app.mount("/webapp", StaticFiles(directory="webapp", html=True), name="webapp")
-app.mount("/media", StaticFiles(directory=settings.MEDIA_ROOT), name="media")
+app.mount("/media", MediaStaticFiles(directory=settings.MEDIA_ROOT), name="media")
+
+# ---- проверка initData мини-аппа (ключ HMAC и кэш проверенных строк — на процесс) ----
+init_data_verifier = InitDataVerifier(settings.BOT_TOKEN, max_age=settings.INIT_DATA_MAX_AGE)
+
+# ---- снимок каталога (None — всегда ходим в БД) ----
+catalog_cache = CatalogCache(settings.CATALOG_CACHE_TTL, media.forget_info) if settings.CATALOG_CACHE else None
 
 # ---- фиксированный список (для сортировки выдачи /api/categories) ----
 CATEGORY_CHOICES = [
@@ -45,28 +88,30 @@ def rub(x) -> str:
         return f"{x} ₽"
 
 
-def parse_telegram_init_data(init_data: str, bot_token: str):
-    if not init_data:
-        return None, False
-    data = dict(urllib.parse.parse_qsl(init_data, keep_blank_values=True))
-    received_hash = data.pop("hash", "")
+def _img_url(media_base: str, relpath: str) -> str:
+    """URL с версией файла: пока она совпадает с файлом, /media отдаёт его как immutable."""
+    url = media_base + quote(relpath)
+    v = media.version(relpath)
+    return f"{url}?v={v}" if v else url
+
 
-    data_check = "\n".join(f"{k}={v}" for k, v in sorted(data.items()))
-    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
-    check_hash = hmac.new(secret_key, data_check.encode(), hashlib.sha256).hexdigest()
-    is_valid = hmac.compare_digest(check_hash, received_hash)
+def _media_base(request: Request) -> str:
+    """Адрес /media/ — url_for один раз на запрос, а не на каждое фото."""
+    return str(request.url_for("media", path=""))
 
-    user = None
-    if "user" in data:
-        try:
-            user = json.loads(data["user"])
-        except Exception:
-            user = None
-    return user, is_valid
 
+async def _catalog_snapshot(request: Request, s: AsyncSession):
+    media_base = _media_base(request)
+    return await catalog_cache.get(s, media_base, lambda p: _map_product(media_base, p), encode_model)
 
-def _img_url(request: Request, relpath: str) -> str:
-    return str(request.url_for("media", path=relpath))
+
+async def _catalog_state(request: Request, s: AsyncSession):
+    """(снимок или None, версия каталога, max(updated_at)) — для ETag/Last-Modified."""
+    if catalog_cache is not None:
+        snap = await _catalog_snapshot(request, s)
+        return snap, snap.version, snap.last_modified
+    version = await catalog_version(s)
+    return None, version, version[2]
 
 
 # ---- схемы ответа ----
@@ -78,17 +123,31 @@ class ProductOut(BaseModel):
     status: str
     image: Optional[str] = None
     images: List[str] = Field(default_factory=list)
+    thumb: Optional[str] = None  # превью первого фото для сетки каталога
+    srcset: Dict[str, str] = Field(default_factory=dict)  # MIME -> "url 320w, url 640w"
     categories: List[str] = Field(default_factory=list)  # одна категория -> список из одного элемента
 
     class Config:
         orm_mode = True
 
 
+class SuggestOut(BaseModel):
+    id: int
+    title: str
+
+
 class CategoryOut(BaseModel):
     name: str
     count: int
 
 
+class ChangesOut(BaseModel):
+    token: str  # передаётся в since следующего запроса
+    reset: bool = False  # true — changed содержит весь каталог, локальную копию заменить
+    changed: List[ProductOut] = Field(default_factory=list)
+    removed: List[int] = Field(default_factory=list)  # сняты с продажи или удалены
+
+
 class WebAppUser(BaseModel):
     id: int
     is_bot: Optional[bool] = None
@@ -99,10 +158,18 @@ class WebAppUser(BaseModel):
     is_premium: Optional[bool] = None
 
 
-def _map_product(request: Request, p: Product) -> ProductOut:
+def _map_product(media_base: str, p: Product) -> ProductOut:
     imgs = sorted(p.images or [], key=lambda i: (i.sort_order, i.id))
-    urls = [_img_url(request, i.path) for i in imgs]
+    urls = [_img_url(media_base, i.path) for i in imgs]
     cats = [p.category] if getattr(p, "category", None) else []
+
+    thumb = urls[0] if urls else None
+    srcset: Dict[str, str] = {}
+    if imgs:
+        for ext, sized in media.variants(imgs[0].path).items():
+            srcset[mime_type(ext)] = ", ".join(f"{_img_url(media_base, path)} {w}w" for w, path in sized)
+            if ext == "jpg":
+                thumb = _img_url(media_base, sized[0][1])  # самое узкое — превью для сетки
     return ProductOut(
         id=p.id,
         title=p.title or "",
@@ -111,6 +178,8 @@ def _map_product(request: Request, p: Product) -> ProductOut:
         status=p.status or "",
         image=(urls[0] if urls else None),
         images=urls,
+        thumb=thumb,
+        srcset=srcset,
         categories=cats,
     )
 
@@ -122,64 +191,338 @@ async def health(s: AsyncSession = Depends(get_session)):
     return {"status": "ok"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    # наружу через traefik не публикуется (туда проксируется только /api)
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+# ---- вебхуки ботов (BOT_MODE=webhook, см. server/webhooks.py) ----
+@app.post("/tg/{name}", include_in_schema=False)
+async def telegram_webhook(name: str, request: Request):
+    webhooks: Webhooks = request.app.state.webhooks
+    hook = webhooks.get(name)
+    if hook is None:
+        raise HTTPException(status_code=404)
+    if not hook.check(request.headers.get(SECRET_HEADER)):
+        raise HTTPException(status_code=403)
+    webhooks.feed(hook, await request.json())
+    return Response(status_code=200)
+
+
 # ---- каталог ----
-@app.get("/api/products", response_model=List[ProductOut])
-async def products(
-    request: Request,
-    q: Optional[str] = None,
-    sort: Optional[str] = None,
-    category: Optional[str] = None,  # фильтр по названию категории
-    s: AsyncSession = Depends(get_session),
+PAGE_LIMIT_MAX = 200
+
+
+def _encode_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return values
+
+
+def _ranked(q: Optional[str], sort: Optional[str]) -> bool:
+    """Выдача поиска без явной сортировки идёт по релевантности, курсор — смещение."""
+    return bool(q and q.strip()) and sort not in ("price_asc", "price_desc")
+
+
+def _products_query(
+    q: Optional[str],
+    sort: Optional[str],
+    category: Optional[str],
+    cursor: Optional[str],
 ):
+    """SELECT активных товаров с фильтрами, сортировкой и keyset-условием курсора.
+
+    Порядок всегда однозначный: (price, id) для сортировок по цене и id desc по умолчанию —
+    по нему же строится курсор следующей страницы."""
     stmt = (
         select(Product)
         .options(selectinload(Product.images))
         .where(Product.is_active == True)
-        .order_by(Product.id.desc())
     )
-    res = (await s.execute(stmt)).scalars().unique().all()
 
-    items = res
+    # Поиск (полнотекстовый индекс, см. server/search.py)
+    rank = None
+    if q and q.strip():
+        stmt, rank = apply_search(stmt, q, engine.dialect.name)
 
-    # Поиск
-    if q:
-        ql = q.lower()
-        items = [p for p in items if ql in (p.title or "").lower() or ql in (p.subtitle or "").lower()]
+    # Фильтр по категории (имена приходят ровно из /api/categories)
+    if category and category.strip():
+        stmt = stmt.where(func.lower(func.trim(Product.category)) == category_key(category))
 
-    # Фильтр по категории
-    if category:
-        want = category.strip().lower()
-        items = [p for p in items if (getattr(p, "category", "") or "").strip().lower() == want]
+    # Сортировка + keyset
+    after = _decode_cursor(cursor) if cursor else None
+    try:
+        if sort == "price_asc":
+            stmt = stmt.order_by(Product.price.asc(), Product.id.asc())
+            if after:
+                price, pid = float(after[0]), int(after[1])
+                stmt = stmt.where(tuple_(Product.price, Product.id) > tuple_(price, pid))
+        elif sort == "price_desc":
+            stmt = stmt.order_by(Product.price.desc(), Product.id.desc())
+            if after:
+                price, pid = float(after[0]), int(after[1])
+                stmt = stmt.where(tuple_(Product.price, Product.id) < tuple_(price, pid))
+        elif _ranked(q, sort):
+            if rank is not None:
+                stmt = stmt.order_by(rank.desc(), Product.id.desc())
+            else:
+                stmt = stmt.order_by(Product.id.desc())
+            if after:
+                stmt = stmt.offset(max(0, int(after[0])))
+        else:
+            stmt = stmt.order_by(Product.id.desc())
+            if after:
+                stmt = stmt.where(Product.id < int(after[0]))
+    except (IndexError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return stmt
+
+
+def _cursor_for(sort: Optional[str], p) -> str:
+    if sort in ("price_asc", "price_desc"):
+        return _encode_cursor([float(p.price or 0), p.id])
+    return _encode_cursor([p.id])
+
+
+NDJSON = "application/x-ndjson"
+STREAM_CHUNK = 500  # строк из БД за одну выборку курсора
+
+
+def _raw_json(response: Response, body: bytes) -> Response:
+    """Готовое тело: FastAPI не валидирует его повторно по response_model и не кодирует заново."""
+    return Response(body, media_type="application/json", headers=dict(response.headers))
+
+
+async def _stream_snapshot(snap, items: list):
+    for i in range(0, len(items), STREAM_CHUNK):
+        yield b"".join(snap.raw[it.id] + b"\n" for it in items[i:i + STREAM_CHUNK])
+
+
+async def _stream_db(media_base: str, stmt):
+    # своя сессия: зависимость get_session закрывается раньше, чем уйдёт тело ответа
+    async with SessionLocal() as s:
+        result = await s.stream(stmt.execution_options(yield_per=STREAM_CHUNK))
+        async for rows in result.scalars().partitions():
+            yield b"".join(encode_model(_map_product(media_base, p)) + b"\n" for p in rows)
 
-    # Сортировка
-    if sort == "price_asc":
-        items = sorted(items, key=lambda x: (x.price or 0))
-    elif sort == "price_desc":
-        items = sorted(items, key=lambda x: (x.price or 0), reverse=True)
 
-    return [_map_product(request, p) for p in items]
+@app.get("/api/products", response_model=List[ProductOut])
+async def products(
+    request: Request,
+    response: Response,
+    q: Optional[str] = None,
+    sort: Optional[str] = None,
+    category: Optional[str] = None,  # фильтр по названию категории
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_LIMIT_MAX),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    s: AsyncSession = Depends(get_session),
+):
+    """Каталог. Без limit — весь список (старое поведение); с limit — страница,
+    курсор следующей страницы отдаётся в заголовке X-Next-Cursor.
+    Поиск (q) всегда идёт в поисковый индекс БД, остальное — из снимка каталога.
+
+    stream=1 или Accept: application/x-ndjson — по товару на строку, по мере чтения
+    (для выгрузок целиком; limit/cursor учитываются, X-Next-Cursor не отдаётся)."""
+    streaming = stream or NDJSON in request.headers.get("accept", "")
+    media_base = _media_base(request)
+    snap, version, last_modified = await _catalog_state(request, s)
+    etag = make_etag(version, media_base, request.url.query, NDJSON if streaming else "")
+    not_modified = conditional(request, response, etag, last_modified, vary="Accept")
+    if not_modified is not None:
+        return not_modified
+
+    if snap is not None and not (q and q.strip()):
+        after = None
+        if cursor:
+            try:
+                after = cursor_key(sort, _decode_cursor(cursor))
+            except (IndexError, TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="invalid cursor")
+        items, more = snap.page(sort, category, after, limit)
+        if streaming:
+            return StreamingResponse(_stream_snapshot(snap, items), media_type=NDJSON, headers=dict(response.headers))
+        if more:
+            response.headers["X-Next-Cursor"] = _cursor_for(sort, items[-1])
+        return _raw_json(response, json_array(snap.raw[it.id] for it in items))
+
+    stmt = _products_query(q, sort, category, cursor)
+    if streaming:
+        if limit:
+            stmt = stmt.limit(limit)
+        return StreamingResponse(_stream_db(media_base, stmt), media_type=NDJSON, headers=dict(response.headers))
+    if limit:
+        stmt = stmt.limit(limit + 1)
+    items = (await s.execute(stmt)).scalars().all()
+
+    if limit and len(items) > limit:
+        items = items[:limit]
+        if _ranked(q, sort):
+            offset = int(_decode_cursor(cursor)[0]) if cursor else 0
+            response.headers["X-Next-Cursor"] = _encode_cursor([offset + limit])
+        else:
+            response.headers["X-Next-Cursor"] = _cursor_for(sort, items[-1])
+
+    return _raw_json(response, json_array(encode_model(_map_product(media_base, p)) for p in items))
+
+
+@app.get("/api/search/suggest", response_model=List[SuggestOut])
+async def search_suggest(
+    q: str = "",
+    limit: int = Query(8, ge=1, le=20),
+    s: AsyncSession = Depends(get_session),
+):
+    """Автодополнение по префиксу: только id и название, без картинок."""
+    if len(q.strip()) < 2:
+        return []
+    stmt = select(Product.id, Product.title).where(Product.is_active == True)
+    stmt, rank = apply_search(stmt, q, engine.dialect.name)
+    if rank is not None:
+        stmt = stmt.order_by(rank.desc(), Product.id.desc())
+    rows = (await s.execute(stmt.limit(limit))).all()
+    return [SuggestOut(id=pid, title=title) for pid, title in rows]
+
+
+# ---- дельты каталога для локальной копии в webapp ----
+# токен — значение catalog_clock (server/catalog.py, stamp_changes). Счётчик растёт в порядке
+# коммитов, поэтому «всё, что помечено больше токена» ничего не теряет, в отличие от времени
+_TOKEN_KIND = "seq"
+
+
+def _decode_since(since: Optional[str]) -> Optional[int]:
+    """Номер изменения из токена; None — токена нет, он негодный или старого формата."""
+    if not since:
+        return None
+    try:
+        kind, seq = _decode_cursor(since)
+    except (HTTPException, ValueError):
+        return None
+    if kind != _TOKEN_KIND or not isinstance(seq, int) or isinstance(seq, bool) or seq < 0:
+        return None
+    return seq
+
+
+@app.get("/api/products/changes", response_model=ChangesOut)
+async def product_changes(
+    request: Request,
+    response: Response,
+    since: Optional[str] = None,
+    s: AsyncSession = Depends(get_session),
+):
+    """Что изменилось в каталоге после токена since: товары, созданные или изменённые
+    (целиком, как в /api/products), и id снятых с продажи или удалённых.
+    Без since (или с негодным токеном) — весь каталог и reset=true."""
+    media_base = _media_base(request)
+    after = _decode_since(since)
+    # счётчик читается до товаров: изменения, закоммиченные после, придут со следующим токеном
+    clock = (await s.execute(select(CatalogClock.value).where(CatalogClock.id == 1))).scalar_one_or_none() or 0
+    if after is not None and after > clock:
+        after = None  # токен из другой базы — только полная выгрузка
+
+    if after is None:
+        snap, _, _ = await _catalog_state(request, s)
+        if snap is not None:
+            # снимок может отставать от счётчика на ttl: токен — тот, на котором он собран
+            clock = snap.version[VERSION_CLOCK] or 0
+            changed = [snap.raw[pid] for pid in sorted(snap.raw, reverse=True)]
+        else:
+            stmt = (
+                select(Product)
+                .options(selectinload(Product.images))
+                .where(Product.is_active == True)
+                .order_by(Product.id.desc())
+            )
+            changed = [encode_model(_map_product(media_base, p)) for p in (await s.execute(stmt)).scalars()]
+        removed: List[int] = []
+    elif after == clock:
+        changed, removed = [], []
+    else:
+        stmt = (
+            select(Product)
+            .options(selectinload(Product.images))
+            .where(Product.change_seq > after)
+            .order_by(Product.id.desc())
+        )
+        rows = (await s.execute(stmt)).scalars().all()
+        changed = [encode_model(_map_product(media_base, p)) for p in rows if p.is_active]
+        removed = [p.id for p in rows if not p.is_active]
+        # id мог достаться новому товару (SQLite переиспользует максимальный) — тогда он в changed
+        present = {p.id for p in rows}
+        tomb = select(ProductTombstone.product_id).where(ProductTombstone.change_seq > after)
+        removed += [pid for pid in (await s.execute(tomb)).scalars() if pid not in present]
+
+    token = _encode_cursor([_TOKEN_KIND, clock])
+    body = b"".join((
+        b'{"token":', dumps(token),
+        b',"reset":', b"true" if after is None else b"false",
+        b',"changed":', json_array(changed),
+        b',"removed":', dumps(removed),
+        b"}",
+    ))
+    # ETag — от самого ответа, а не от токена: одинаковый токен ещё не значит одинаковые данные
+    not_modified = conditional(request, response, make_etag(body))
+    if not_modified is not None:
+        return not_modified
+    return _raw_json(response, body)
 
 
 @app.get("/api/products/{pid}", response_model=ProductOut)
-async def get_product(pid: int, request: Request, s: AsyncSession = Depends(get_session)):
+async def get_product(pid: int, request: Request, response: Response, s: AsyncSession = Depends(get_session)):
+    media_base = _media_base(request)
+    snap, version, _ = await _catalog_state(request, s)
+    etag = make_etag(version, media_base, pid)
+    if snap is not None and pid in snap.by_id:
+        not_modified = conditional(request, response, etag, snap.updated.get(pid))
+        if not_modified is not None:
+            return not_modified
+        return _raw_json(response, snap.raw[pid])
+
+    # неактивные товары в снимок не входят — их отдаём из БД, как раньше
     p = await s.get(Product, pid, options=(selectinload(Product.images),))
     if not p:
         raise HTTPException(status_code=404, detail="Product not found")
-    return _map_product(request, p)
+    not_modified = conditional(request, response, etag, p.updated_at)
+    if not_modified is not None:
+        return not_modified
+    return _raw_json(response, encode_model(_map_product(media_base, p)))
 
 
 @app.get("/api/categories", response_model=List[CategoryOut])
-async def categories(s: AsyncSession = Depends(get_session)):
+async def categories(request: Request, response: Response, s: AsyncSession = Depends(get_session)):
     """Список категорий с количеством активных товаров (count>0)."""
-    stmt = select(Product).where(Product.is_active == True)
-    res = (await s.execute(stmt)).scalars().unique().all()
+    snap, version, last_modified = await _catalog_state(request, s)
+    not_modified = conditional(request, response, make_etag(version, "categories"), last_modified)
+    if not_modified is not None:
+        return not_modified
+    if snap is not None:
+        return _order_categories(snap.counts)
+
+    stmt = (
+        select(Product.category, func.count(Product.id))
+        .where(Product.is_active == True)
+        .group_by(Product.category)
+    )
     counts: Dict[str, int] = {}
-    for p in res:
-        c = (getattr(p, "category", "") or "").strip()
+    for name, cnt in (await s.execute(stmt)).all():
+        c = (name or "").strip()
         if not c:
             continue
-        counts[c] = counts.get(c, 0) + 1
+        counts[c] = counts.get(c, 0) + cnt
+    return _order_categories(counts)
 
+
+def _order_categories(counts: Dict[str, int]) -> List[CategoryOut]:
     out: List[CategoryOut] = []
     seen = set()
     # сначала известные (в заданном порядке)
@@ -196,32 +539,30 @@ async def categories(s: AsyncSession = Depends(get_session)):
 
 @app.post("/api/webapp-opened")
 async def webapp_opened(
-    user_data: WebAppUser,
+    request: Request,
+    init: InitData = Depends(init_data_verifier),
 ):
-    print("In webapp_opened")
-    # save user
-    db_user = await save_user(
-        user=User(
-            id=user_data.id,
-            username=user_data.username,
-            name=user_data.first_name,
-        )
-    )
-    user_log = UserLog(
-        user_id=db_user.id,
-        action=UserLogAction.WEB_APP_OPENED.value,
-    )
-    async with SessionLocal() as db:
-        db.add(user_log)
-        await db.commit()
-        await db.refresh(user_log)
-
+    # пользователь берётся из подписанного initData (заголовок Authorization: tma ...), а не из тела
+    # подпись подтверждает только, что строку выдал Telegram, но не форму поля user
+    try:
+        user_data = WebAppUser.model_validate(init.user)
+    except ValidationError:
+        raise HTTPException(status_code=400, detail="invalid initData user")
+    # пользователь и лог открытия попадут в БД пачкой (server/events.py)
+    request.app.state.events.webapp_opened(user_data.id, user_data.username, user_data.first_name)
     return {"status": "ok"}
 
 
-# ---- приём заказа и пересылка в TG ----
+# ---- приём заказа: сохраняем в БД, в TG доставляет outbox-воркер ----
+def _int_or_none(v) -> Optional[int]:
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
 @app.post("/api/submit_cart")
-async def submit_cart(req: Request):
+async def submit_cart(req: Request, s: AsyncSession = Depends(get_session)):
     try:
         body = await req.json()
     except Exception:
@@ -232,7 +573,7 @@ async def submit_cart(req: Request):
         raise HTTPException(400, "empty cart")
 
     init_data = body.get("init_data") or ""
-    user, valid = parse_telegram_init_data(init_data, settings.BOT_TOKEN)
+    user, valid = init_data_verifier.check(init_data)
 
     contact = body.get("contact") or {}
     name = str(contact.get("name") or "").strip()
@@ -264,12 +605,16 @@ async def submit_cart(req: Request):
 
     lines += ["", "<b>Товары:</b>"]
     total = 0.0
+    order_items: List[OrderItem] = []
     for i, it in enumerate(items, 1):
         title = str(it.get("title") or "")
         qty = int(it.get("qty") or 0)
         price = float(it.get("price") or 0)
         subtotal = qty * price
         total += subtotal
+        order_items.append(
+            OrderItem(product_id=_int_or_none(it.get("id")), title=title[:255], qty=qty, price=price)
+        )
 
         lines.append(f"<b>#{i}</b> {title}")
         lines.append(f"• Кол-во: {qty}")
@@ -294,22 +639,34 @@ async def submit_cart(req: Request):
     except Exception:
         pass
 
-    text_msg = "\n".join(lines)
-
     seller_id = int(getattr(settings, "SELLER_CHAT_ID", 0) or 0)
     if not getattr(settings, "BOT_TOKEN", None) or not seller_id:
         raise HTTPException(500, "Bot configuration is invalid")
 
-    async with Bot(settings.BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML")) as tgbot:
-        try:
-            await tgbot.send_message(seller_id, text_msg, disable_web_page_preview=True)
-        except TelegramForbiddenError:
-            raise HTTPException(403, "Bot cannot message SELLER_CHAT_ID (no /start or blocked)")
-        except TelegramBadRequest as e:
-            raise HTTPException(400, f"Telegram BadRequest: {e}")
-        except TelegramNetworkError as e:
-            raise HTTPException(502, f"Telegram network error: {e}")
-        except Exception as e:
-            raise HTTPException(500, f"Unexpected error: {e}")
-
-    return {"ok": True}
+    order = Order(
+        user_id=_int_or_none(user.get("id")) if user else None,
+        username=(user.get("username") if user else None),
+        full_name=(" ".join([user.get("first_name") or "", user.get("last_name") or ""]).strip() if user else None),
+        init_data_valid=bool(user and valid),
+        contact_name=name[:255],
+        contact_phone=phone[:64],
+        contact_tg=tg_at[:64],
+        total=total,
+        items=order_items,
+    )
+    s.add(order)
+    await s.flush()
+
+    lines[0] = f"🧺 <b>Новый заказ #{order.id}</b>"
+    s.add(
+        OutboxMessage(
+            chat_id=seller_id,
+            text="\n".join(lines),
+            order_id=order.id,
+            next_attempt_at=datetime.now(timezone.utc),
+        )
+    )
+    await s.commit()
+    req.app.state.outbox.notify()
+
+    return {"ok": True, "order_id": order.id}
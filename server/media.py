@@ -0,0 +1,241 @@
+# server/media.py
+"""Хранилище фото товаров по содержимому.
+
+Файл лежит один раз под blobs/ab/cd/<sha256>.<ext> (рядом — его превью, см. server/images.py)
+и может использоваться несколькими ProductImage. Учёт ссылок — в media_blobs.refcount:
+файл удаляется, только когда его не использует ни один товар. Повторно присланное
+в бот фото узнаётся по file_unique_id ещё до скачивания.
+
+Порядок записи: put_file() (без БД) → acquire() → settle() → коммит; после коммита или
+отката — collect() для освободившихся blob'ов. Решение «файл уже есть, скачанный не нужен»
+принимается только под блокировкой строки media_blobs, а collect() стирает файл в той же
+транзакции, что и запись, — поэтому параллельные загрузка и удаление одного и того же
+фото не оставляют запись без файла.
+
+Старые фото (products/<pid>/<uuid>.jpg, blob_hash пустой) продолжают работать как раньше.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from server.db import SessionLocal, dialect_insert
+from server.images import THUMB_WIDTH, available_variants, build_variants, remove_variants, variant_path
+from server.models import MediaBlob
+
+BLOBS_DIR = "blobs"
+_BLOB_NAME = re.compile(r"^[0-9a-f]{64}$")
+# описание файлов для ответов API (версия, превью) кэшируется: иначе каждый товар на SQL-пути
+# выдачи — это несколько stat() на запрос. Пересборка снимка каталога сбрасывает кэш целиком
+INFO_TTL = 60.0
+INFO_MAX = 50_000
+
+
+def blob_relpath(digest: str, ext: str) -> str:
+    return "/".join((BLOBS_DIR, digest[:2], digest[2:4], f"{digest}{ext}"))
+
+
+def tmp_path(ext: str = ".jpg") -> str:
+    """Временный файл для загрузки — на той же ФС, что и blobs (os.replace атомарен)."""
+    d = os.path.join(settings.MEDIA_ROOT, BLOBS_DIR, "tmp")
+    os.makedirs(d, exist_ok=True)
+    return os.path.join(d, f"{uuid.uuid4().hex}{ext}")
+
+
+def fingerprint(relpath: str) -> Optional[str]:
+    """Версия файла для ?v= в URL. None — файла нет."""
+    try:
+        st = os.stat(os.path.join(settings.MEDIA_ROOT, relpath))
+    except OSError:
+        return None
+    return stat_fingerprint(st)
+
+
+def stat_fingerprint(st: os.stat_result) -> str:
+    """mtime и размер в hex — как ETag у nginx ("5f1c...-1a2b"): и /media в FastAPI, и nginx
+    сверяют ?v= с самим файлом и отдают immutable только при точном совпадении."""
+    return f"{int(st.st_mtime):x}-{st.st_size:x}"
+
+
+_info: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+
+
+def _memo(key: Tuple[str, str], compute: Callable[[], Any]) -> Any:
+    now = time.monotonic()
+    hit = _info.get(key)
+    if hit is not None and hit[0] > now:
+        return hit[1]
+    value = compute()
+    if len(_info) >= INFO_MAX:
+        _info.clear()
+    _info[key] = (now + INFO_TTL, value)
+    return value
+
+
+def version(relpath: str) -> Optional[str]:
+    """fingerprint() с кэшем — для ссылок в ответах API."""
+    return _memo(("v", relpath), lambda: fingerprint(relpath))
+
+
+def variants(relpath: str) -> Dict[str, List[Tuple[int, str]]]:
+    """available_variants() с кэшем: {ext: [(ширина, relpath производной)]}."""
+    return _memo(("s", relpath), lambda: available_variants(settings.MEDIA_ROOT, relpath))
+
+
+def forget_info():
+    _info.clear()
+
+
+def _sha256(path: str) -> Tuple[str, int]:
+    h = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+            size += len(chunk)
+    return h.hexdigest(), size
+
+
+def _existing(digest: str) -> Optional[str]:
+    """Тот же файл мог прийти раньше с другим расширением — blob один на хеш."""
+    shard = os.path.dirname(blob_relpath(digest, ""))
+    try:
+        names = os.listdir(os.path.join(settings.MEDIA_ROOT, shard))
+    except FileNotFoundError:
+        return None
+    for name in names:
+        if os.path.splitext(name)[0] == digest:
+            return f"{shard}/{name}"
+    return None
+
+
+async def put_file(src: str, ext: str = ".jpg") -> Tuple[str, str, int]:
+    """Считает хеш скачанного файла и, если такого blob'а на диске ещё нет, выкладывает его
+    жёсткой ссылкой (src остаётся до settle()) и готовит превью. Без БД — можно звать
+    параллельно. Возвращает (sha256, relpath, size)."""
+    digest, size = await asyncio.to_thread(_sha256, src)
+    relpath = _existing(digest) or blob_relpath(digest, ext)
+    dest = os.path.join(settings.MEDIA_ROOT, relpath)
+    if not os.path.exists(dest):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        try:
+            os.link(src, dest)
+        except FileExistsError:
+            pass
+    if not os.path.exists(variant_path(dest, THUMB_WIDTH, "jpg")):
+        await build_variants(dest)
+    return digest, relpath, size
+
+
+async def settle(src: str, blob: MediaBlob):
+    """После acquire(): ссылка взята, до коммита файл blob'а никто не сотрёт. Если его
+    успел стереть collect() между put_file() и acquire() — кладём заново из src."""
+    dest = os.path.join(settings.MEDIA_ROOT, blob.path)
+    if os.path.exists(dest):
+        os.remove(src)
+        return
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    os.replace(src, dest)
+    await build_variants(dest)
+
+
+async def acquire(
+    s: AsyncSession, digest: str, relpath: str, size: int, file_unique_id: Optional[str] = None
+) -> MediaBlob:
+    """+1 ссылка на blob (создаёт запись, если её нет) и блокировка строки до коммита.
+    Коммит — за вызывающим."""
+    stmt = dialect_insert(MediaBlob).values(
+        sha256=digest, path=relpath, size=size, refcount=1, file_unique_id=file_unique_id,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MediaBlob.sha256],
+        set_={"refcount": MediaBlob.refcount + 1},
+    ).returning(MediaBlob)
+    blob = (await s.execute(stmt, execution_options={"populate_existing": True})).scalar_one()
+    if file_unique_id and not blob.file_unique_id:
+        blob.file_unique_id = file_unique_id
+    return blob
+
+
+async def acquire_by_unique_id(s: AsyncSession, file_unique_id: str) -> Optional[MediaBlob]:
+    """То же фото из Telegram уже лежит в хранилище — +1 ссылка без скачивания.
+    Файл проверяется уже под блокировкой строки: до неё его мог стереть collect()."""
+    found = (
+        await s.execute(select(MediaBlob.sha256, MediaBlob.path).where(MediaBlob.file_unique_id == file_unique_id).limit(1))
+    ).first()
+    # файла нет — без записи в БД: вызывающий будет качать, транзакцию открывать незачем
+    if found is None or not os.path.exists(os.path.join(settings.MEDIA_ROOT, found.path)):
+        return None
+    digest = found.sha256
+    blob = (
+        await s.execute(
+            update(MediaBlob)
+            .where(MediaBlob.sha256 == digest)
+            .values(refcount=MediaBlob.refcount + 1)
+            .returning(MediaBlob),
+            execution_options={"populate_existing": True},
+        )
+    ).scalar_one_or_none()
+    if blob is None:  # запись успели удалить
+        return None
+    if not os.path.exists(os.path.join(settings.MEDIA_ROOT, blob.path)):
+        blob.refcount -= 1  # стёрт между проверками — пусть вызывающий скачает фото заново
+        await s.flush()
+        return None
+    return blob
+
+
+async def release(s: AsyncSession, digest: str) -> Optional[str]:
+    """-1 ссылка. Если blob больше никому не нужен — возвращает relpath для collect()
+    после коммита; запись с refcount 0 остаётся до него."""
+    row = (
+        await s.execute(
+            update(MediaBlob)
+            .where(MediaBlob.sha256 == digest)
+            .values(refcount=MediaBlob.refcount - 1)
+            .returning(MediaBlob.refcount, MediaBlob.path)
+        )
+    ).first()
+    if row is None or row.refcount > 0:
+        return None
+    return row.path
+
+
+async def collect(relpaths: Iterable[str]):
+    """Стирает blob'ы без ссылок — после коммита release() или после отката загрузки,
+    успевшей выложить файл через put_file(). На каждый blob — своя короткая транзакция:
+    запись удаляется, файл стирается, и только потом коммит; параллельный acquire()
+    ждёт на блокировке строки и видит уже стёртый файл (settle() положит его заново)."""
+    for relpath in relpaths:
+        digest = os.path.splitext(os.path.basename(relpath))[0]
+        if not _BLOB_NAME.match(digest):
+            continue
+        async with SessionLocal() as s:
+            # записи нет (откат загрузки) — пустая строка, чтобы было что блокировать
+            await s.execute(
+                dialect_insert(MediaBlob)
+                .values(sha256=digest, path=relpath, refcount=0)
+                .on_conflict_do_nothing(index_elements=[MediaBlob.sha256])
+            )
+            freed = (
+                await s.execute(
+                    delete(MediaBlob)
+                    .where(MediaBlob.sha256 == digest, MediaBlob.refcount <= 0)
+                    .returning(MediaBlob.path)
+                )
+            ).scalar_one_or_none()
+            if freed is not None:
+                abs_path = os.path.join(settings.MEDIA_ROOT, freed)
+                try:
+                    os.remove(abs_path)
+                except FileNotFoundError:
+                    pass
+                remove_variants(abs_path)
+            await s.commit()
@@ -0,0 +1,283 @@
+# server/metrics.py
+"""Метрики в текстовом формате Prometheus (без внешних зависимостей).
+
+- http_request_duration_seconds / http_requests_in_flight — по шаблону маршрута;
+- db_queries_per_request / db_time_per_request_seconds — сколько SQL и сколько времени
+  на один запрос к API (N+1 видно сразу), считаются через события engine;
+- db_pool_* — занятость пула соединений на момент опроса;
+- telegram_request_duration_seconds — вызовы Bot API (уведомления продавцу и т.п.).
+
+Всё пишется из одного event loop, поэтому без блокировок.
+"""
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+LabelValues = Tuple[str, ...]
+
+
+def _fmt_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_fmt_labels(self.labels, k)} {_num(v)}" for k, v in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """Gauge; с fn значение снимается в момент опроса."""
+    kind = "gauge"
+
+    def __init__(self, *a, fn: Optional[Callable[[], float]] = None, **kw):
+        super().__init__(*a, **kw)
+        self._values: Dict[LabelValues, float] = {}
+        self._fn = fn
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def render(self) -> List[str]:
+        values = dict(self._values)
+        if self._fn is not None:
+            try:
+                values[()] = self._fn()
+            except Exception:
+                return []
+        return self.header() + [
+            f"{self.name}{_fmt_labels(self.labels, k)} {_num(v)}" for k, v in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *a, buckets: Iterable[float] = LATENCY_BUCKETS, **kw):
+        super().__init__(*a, **kw)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счётчики по корзинам..., +Inf, sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        row = self._values.get(labels)
+        if row is None:
+            row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                row[i] += 1
+                break
+        else:
+            row[len(self.buckets)] += 1
+        row[-1] += value
+
+    def render(self) -> List[str]:
+        out = self.header()
+        for labels, row in self._values.items():
+            acc = 0
+            for b, n in zip(self.buckets + (float("inf"),), row):
+                acc += n
+                le = 'le="%s"' % _num(b)
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, labels, le)} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, labels)} {_num(row[-1])}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, labels)} {acc}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines += m.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+http_duration = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", ("method", "route", "status"),
+))
+http_in_flight = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "Запросы в обработке",
+))
+db_queries_per_request = REGISTRY.register(Histogram(
+    "db_queries_per_request", "SQL-запросов на один HTTP-запрос", ("route",), buckets=COUNT_BUCKETS,
+))
+db_time_per_request = REGISTRY.register(Histogram(
+    "db_time_per_request_seconds", "Суммарное время SQL на один HTTP-запрос", ("route",), buckets=DB_BUCKETS,
+))
+db_query_duration = REGISTRY.register(Histogram(
+    "db_query_duration_seconds", "Время одного SQL-запроса", buckets=DB_BUCKETS,
+))
+telegram_duration = REGISTRY.register(Histogram(
+    "telegram_request_duration_seconds", "Вызовы Bot API", ("method", "result"),
+))
+
+
+# ---- HTTP ----
+class _RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_request_stats: ContextVar[Optional[_RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def _route_template(scope) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path:
+        return path
+    # старые Starlette не кладут route в scope — ищем по endpoint
+    endpoint = scope.get("endpoint")
+    app = scope.get("app")
+    if endpoint is not None and app is not None:
+        for r in getattr(app, "routes", ()):
+            if getattr(r, "endpoint", None) is endpoint:
+                return r.path
+    # не плодим серии на каждый несуществующий URL
+    return "<unmatched>"
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: латентность по шаблону маршрута, запросы в полёте, SQL на запрос."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = ["500"]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        stats = _RequestStats()
+        token = _request_stats.set(stats)
+        http_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec()
+            _request_stats.reset(token)
+            route = _route_template(scope)
+            http_duration.observe(elapsed, scope["method"], route, status[0])
+            db_queries_per_request.observe(stats.queries, route)
+            db_time_per_request.observe(stats.db_seconds, route)
+
+
+# ---- SQLAlchemy ----
+def instrument_engine(engine: AsyncEngine):
+    """Время каждого SQL и счётчики на текущий HTTP-запрос; gauges пула."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_metrics_t0", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get("_metrics_t0")
+        if not stack:
+            return
+        elapsed = time.perf_counter() - stack.pop()
+        db_query_duration.observe(elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+    pool = sync_engine.pool
+    for name, doc, attr in (
+        ("db_pool_size", "Размер пула соединений", "size"),
+        ("db_pool_checked_out", "Соединения, выданные из пула", "checkedout"),
+        ("db_pool_overflow", "Соединения сверх pool_size (меньше нуля — пул ещё не заполнен)", "overflow"),
+    ):
+        fn = getattr(pool, attr, None)
+        if fn is not None:
+            REGISTRY.register(Gauge(name, doc, fn=fn))
+
+
+# ---- Telegram ----
+class TelegramMetricsMiddleware:
+    """Request-middleware aiogram: длительность каждого вызова Bot API."""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        result = "error"
+        try:
+            response = await make_request(bot, method)
+            result = "ok"
+            return response
+        finally:
+            telegram_duration.observe(time.perf_counter() - started, type(method).__name__, result)
+
+
+def render() -> str:
+    return REGISTRY.render()
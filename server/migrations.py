@@ -0,0 +1,182 @@
+# server/migrations.py
+"""Версионные миграции схемы.
+
+create_all создаёт только отсутствующие таблицы (вместе с их индексами), но не трогает
+существующие — всё, что нужно довести на уже работающих базах, оформляется шагом ниже.
+Применённые версии хранятся в schema_migrations; каждый шаг идемпотентен.
+
+Запуск вручную (админ-бот делает это сам при старте):
+    python -m server.migrations
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, String, Table, func, insert, inspect, select
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from server import models  # noqa: F401  (регистрирует таблицы в Base.metadata)
+from server.db import Base, engine
+from server.search import ensure_search_schema
+
+log = logging.getLogger(__name__)
+
+schema_migrations = Table(
+    "schema_migrations",
+    Base.metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(128), nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+async def _create_indexes(conn: AsyncConnection, *tables: Table):
+    """Индексы, объявленные в models.py, которых ещё нет в БД."""
+
+    def run(sync_conn):
+        insp = inspect(sync_conn)
+        for table in tables:
+            existing = {ix["name"] for ix in insp.get_indexes(table.name)}
+            columns = {c["name"] for c in insp.get_columns(table.name)}
+            for index in table.indexes:
+                # индекс по колонке из более позднего шага создаст тот шаг
+                if index.name not in existing and all(c.name in columns for c in index.columns):
+                    index.create(sync_conn)
+
+    await conn.run_sync(run)
+
+
+async def _add_column_if_missing(conn: AsyncConnection, table: Table, name: str):
+    """ALTER TABLE ADD COLUMN по описанию колонки из models.py."""
+
+    def run(sync_conn):
+        if name in {c["name"] for c in inspect(sync_conn).get_columns(table.name)}:
+            return
+        column = table.c[name]
+        ddl = f"{column.name} {column.type.compile(dialect=sync_conn.dialect)}"
+        if not column.nullable:
+            raise RuntimeError(f"{table.name}.{name}: NOT NULL колонку добавляйте с default отдельным шагом")
+        sync_conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+
+    await conn.run_sync(run)
+
+
+# ---- шаги ----
+async def _m001_search(conn: AsyncConnection):
+    await ensure_search_schema(conn)
+
+
+async def _m002_catalog_indexes(conn: AsyncConnection):
+    await _create_indexes(
+        conn,
+        models.Product.__table__,
+        models.ProductImage.__table__,
+        models.UserLog.__table__,
+        models.OrderItem.__table__,
+        models.OutboxMessage.__table__,
+    )
+    if conn.dialect.name == "postgresql":
+        await conn.exec_driver_sql("ANALYZE products")
+        await conn.exec_driver_sql("ANALYZE product_images")
+    else:
+        await conn.exec_driver_sql("ANALYZE")
+
+
+async def _m003_product_sku(conn: AsyncConnection):
+    await _add_column_if_missing(conn, models.Product.__table__, "sku")
+    await _create_indexes(conn, models.Product.__table__)
+
+
+async def _m004_image_file_id(conn: AsyncConnection):
+    await _add_column_if_missing(conn, models.ProductImage.__table__, "file_id")
+
+
+async def _m005_media_blobs(conn: AsyncConnection):
+    # таблицу media_blobs создаёт create_all; старые фото остаются на своих путях
+    await _add_column_if_missing(conn, models.ProductImage.__table__, "blob_hash")
+    await _create_indexes(conn, models.ProductImage.__table__)
+
+
+async def _m006_product_tombstones(conn: AsyncConnection):
+    # таблицу создаёт create_all; шаг фиксирует версию и доводит индекс на ранних сборках
+    await _create_indexes(conn, models.ProductTombstone.__table__)
+
+
+async def _m007_broadcasts(conn: AsyncConnection):
+    # таблицу broadcasts создаёт create_all; NULL в is_blocked значит «не заблокирован»
+    await _add_column_if_missing(conn, models.User.__table__, "is_blocked")
+
+
+async def _m008_user_logs_rowid(conn: AsyncConnection):
+    # ранние базы создавались с id BIGINT: на SQLite это не алиас rowid, и INSERT без id падал.
+    # ALTER COLUMN в SQLite нет — таблица пересоздаётся по models.py с переносом строк
+    if conn.dialect.name != "sqlite":
+        return
+    table = models.UserLog.__table__
+
+    def run(sync_conn):
+        insp = inspect(sync_conn)
+        pk = next(c for c in insp.get_columns(table.name) if c["name"] == "id")
+        if str(pk["type"]).upper() == "INTEGER":
+            return
+        for ix in insp.get_indexes(table.name):
+            sync_conn.exec_driver_sql(f"DROP INDEX {ix['name']}")
+        sync_conn.exec_driver_sql(f"ALTER TABLE {table.name} RENAME TO {table.name}_old")
+        table.create(sync_conn)
+        names = ", ".join(c.name for c in table.columns)
+        sync_conn.exec_driver_sql(f"INSERT INTO {table.name} ({names}) SELECT {names} FROM {table.name}_old")
+        sync_conn.exec_driver_sql(f"DROP TABLE {table.name}_old")
+
+    await conn.run_sync(run)
+
+
+async def _m009_catalog_clock(conn: AsyncConnection):
+    # таблицу catalog_clock создаёт create_all; старые товары остаются с NULL — клиенты
+    # со старым токеном всё равно получают каталог целиком (reset)
+    await _add_column_if_missing(conn, models.Product.__table__, "change_seq")
+    await _add_column_if_missing(conn, models.ProductTombstone.__table__, "change_seq")
+    await _create_indexes(conn, models.Product.__table__, models.ProductTombstone.__table__)
+    clock = models.CatalogClock.__table__
+    if (await conn.execute(select(clock.c.id).where(clock.c.id == 1))).first() is None:
+        await conn.execute(insert(clock).values(id=1, value=0))
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[AsyncConnection], Awaitable[None]]]] = [
+    (1, "search", _m001_search),
+    (2, "catalog_indexes", _m002_catalog_indexes),
+    (3, "product_sku", _m003_product_sku),
+    (4, "image_file_id", _m004_image_file_id),
+    (5, "media_blobs", _m005_media_blobs),
+    (6, "product_tombstones", _m006_product_tombstones),
+    (7, "broadcasts", _m007_broadcasts),
+    (8, "user_logs_rowid", _m008_user_logs_rowid),
+    (9, "catalog_clock", _m009_catalog_clock),
+]
+
+
+async def migrate(conn: AsyncConnection) -> List[int]:
+    """create_all + недостающие шаги по порядку; возвращает применённые версии."""
+    await conn.run_sync(Base.metadata.create_all)
+    applied = set((await conn.execute(select(schema_migrations.c.version))).scalars())
+
+    done = []
+    for version, name, step in MIGRATIONS:
+        if version in applied:
+            continue
+        log.info("migration %03d %s", version, name)
+        await step(conn)
+        await conn.execute(insert(schema_migrations).values(version=version, name=name))
+        done.append(version)
+    return done
+
+
+async def _main():
+    async with engine.begin() as conn:
+        done = await migrate(conn)
+    await engine.dispose()
+    print("applied:", ", ".join(f"{v:03d}" for v in done) if done else "nothing, schema is up to date")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    asyncio.run(_main())
@@ -1,6 +1,6 @@
-from typing import List
+from typing import List, Optional
 from enum import Enum
-from sqlalchemy import Integer, String, Float, DateTime, ForeignKey, Boolean, func, Column, BigInteger
+from sqlalchemy import Integer, String, Float, DateTime, ForeignKey, Boolean, func, Column, BigInteger, Text, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from server.db import Base
 
@@ -17,9 +17,13 @@ class Product(Base):
 
     # делаем NOT NULL + дефолт пустая строка, чтобы ORM не вставлял NULL
     category: Mapped[str] = mapped_column(String(256), nullable=False, default="")
+    # артикул поставщика — ключ массового импорта (server/importer.py); у товаров из бота пустой
+    sku: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
 
     created_at: Mapped[str] = mapped_column(DateTime(timezone=True), server_default=func.now())
     updated_at: Mapped[str] = mapped_column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
+    # значение catalog_clock транзакции, изменившей товар последней; NULL — до появления счётчика
+    change_seq: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
 
     images: Mapped[List["ProductImage"]] = relationship(
         "ProductImage",
@@ -36,10 +40,64 @@ class ProductImage(Base):
     product_id: Mapped[int] = mapped_column(ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
     path: Mapped[str] = mapped_column(String(512), nullable=False)
     sort_order: Mapped[int] = mapped_column(Integer, default=0)
+    # file_id фото в Telegram (админ-бот): карточка пересылается по ссылке, без повторной загрузки
+    file_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # sha256 файла в хранилище blobs (server/media.py); у старых фото из products/<pid>/ пустой
+    blob_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
 
     product: Mapped[Product] = relationship("Product", back_populates="images")
 
 
+class MediaBlob(Base):
+    """Файл фото в хранилище по содержимому; refcount — сколько ProductImage на него ссылаются."""
+    __tablename__ = "media_blobs"
+
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    path: Mapped[str] = mapped_column(String(512), nullable=False)
+    size: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    refcount: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # file_unique_id Telegram: то же фото, присланное повторно, не скачивается
+    file_unique_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True, index=True)
+    created_at: Mapped[str] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+
+class ProductTombstone(Base):
+    """Удалённый товар: по нему /api/products/changes сообщает клиентам, что id больше нет."""
+    __tablename__ = "product_tombstones"
+
+    product_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    deleted_at: Mapped[str] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    change_seq: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+
+
+class CatalogClock(Base):
+    """Счётчик изменений каталога, одна строка: пишущая транзакция берёт следующее значение
+    и метит им товары (server/catalog.py, stamp_changes). Из него — токен /api/products/changes."""
+    __tablename__ = "catalog_clock"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    value: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+
+# Выдача каталога всегда фильтрует is_active и сортирует по id или (price, id), часто внутри категории:
+# частичные индексы покрывают ровно эти пути. Создаются миграцией (server/migrations.py).
+_ACTIVE = Product.is_active == True
+Index("ix_products_active_id", Product.id, postgresql_where=_ACTIVE, sqlite_where=_ACTIVE)
+Index("ix_products_active_price", Product.price, Product.id, postgresql_where=_ACTIVE, sqlite_where=_ACTIVE)
+Index("ix_products_active_category_id", Product.category, Product.id, postgresql_where=_ACTIVE, sqlite_where=_ACTIVE)
+Index(
+    "ix_products_active_category_price", Product.category, Product.price, Product.id,
+    postgresql_where=_ACTIVE, sqlite_where=_ACTIVE,
+)
+Index("ix_products_updated_at", Product.updated_at)  # max() для версии каталога
+Index("ux_products_sku", Product.sku, unique=True)
+Index("ix_product_images_product", ProductImage.product_id, ProductImage.sort_order)
+Index("ix_product_images_blob", ProductImage.blob_hash)
+Index("ix_product_tombstones_deleted_at", ProductTombstone.deleted_at)
+Index("ix_products_change_seq", Product.change_seq)
+Index("ix_product_tombstones_change_seq", ProductTombstone.change_seq)
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -51,11 +109,14 @@ class User(Base):
         DateTime(timezone=True),
         default=func.now(),
     )
+    # бот магазина заблокирован (Forbidden при рассылке); /start снимает отметку
+    is_blocked = Column(Boolean, default=False)
 
 
 class UserLog(Base):
     __tablename__ = "user_logs"
-    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    # на SQLite автоинкремент есть только у INTEGER PRIMARY KEY
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
     user_id = Column(BigInteger)
     action = Column(String(50))
     datetime = Column(
@@ -64,5 +125,113 @@ class UserLog(Base):
     )
 
 
+Index("ix_user_logs_user_datetime", UserLog.user_id, UserLog.datetime)
+
+
 class UserLogAction(Enum):
     WEB_APP_OPENED = "web_app_opened"
+
+
+class Order(Base):
+    __tablename__ = "orders"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # покупатель из initData (если мини-апп открыт в Telegram)
+    user_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    username: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    full_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    init_data_valid: Mapped[bool] = mapped_column(Boolean, default=False)
+    # контакты из формы корзины
+    contact_name: Mapped[str] = mapped_column(String(255), default="")
+    contact_phone: Mapped[str] = mapped_column(String(64), default="")
+    contact_tg: Mapped[str] = mapped_column(String(64), default="")
+
+    total: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    created_at: Mapped[str] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+    items: Mapped[List["OrderItem"]] = relationship(
+        "OrderItem",
+        back_populates="order",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+
+class OrderItem(Base):
+    __tablename__ = "order_items"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    order_id: Mapped[int] = mapped_column(ForeignKey("orders.id", ondelete="CASCADE"), nullable=False)
+    product_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)  # без FK: товар могут удалить
+    title: Mapped[str] = mapped_column(String(255), nullable=False)
+    qty: Mapped[int] = mapped_column(Integer, nullable=False)
+    price: Mapped[float] = mapped_column(Float, nullable=False)
+
+    order: Mapped[Order] = relationship("Order", back_populates="items")
+
+
+Index("ix_order_items_order", OrderItem.order_id)
+
+
+class OutboxStatus(Enum):
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+
+
+class OutboxMessage(Base):
+    """Исходящее сообщение в Telegram; доставляет server/outbox.py."""
+    __tablename__ = "outbox"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+    order_id: Mapped[Optional[int]] = mapped_column(ForeignKey("orders.id", ondelete="SET NULL"), nullable=True)
+
+    status: Mapped[str] = mapped_column(String(16), default=OutboxStatus.PENDING.value)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[str] = mapped_column(DateTime(timezone=True), nullable=False)
+    last_error: Mapped[Optional[str]] = mapped_column(String(512), nullable=True)
+
+    created_at: Mapped[str] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    sent_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+_PENDING = OutboxMessage.status == OutboxStatus.PENDING.value
+Index("ix_outbox_pending", OutboxMessage.next_attempt_at, postgresql_where=_PENDING, sqlite_where=_PENDING)
+
+
+class BroadcastStatus(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    CANCELLED = "cancelled"
+
+
+class Broadcast(Base):
+    """Рассылка всем пользователям от бота магазина; отправляет server/broadcast.py."""
+    __tablename__ = "broadcasts"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(String(16), nullable=False)  # text | photo | product
+    text: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # HTML; у фото — подпись
+    # фото относительно MEDIA_ROOT; file_id — выданный боту магазина после первой загрузки
+    photo_path: Mapped[Optional[str]] = mapped_column(String(512), nullable=True)
+    photo_file_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    product_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)  # кнопка «Открыть товар»
+
+    status: Mapped[str] = mapped_column(String(16), default=BroadcastStatus.PENDING.value)
+    # users.id, до которого (включительно) все уже обработаны — с него продолжается после рестарта
+    cursor: Mapped[int] = mapped_column(BigInteger, default=0)
+    sent: Mapped[int] = mapped_column(Integer, default=0)
+    failed: Mapped[int] = mapped_column(Integer, default=0)
+    blocked: Mapped[int] = mapped_column(Integer, default=0)
+    # аренда: пока не истекла, рассылку ведёт один процесс
+    locked_until: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    # куда админ-боту показывать прогресс
+    admin_chat_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    progress_message_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+
+    created_at: Mapped[str] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    finished_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,156 @@
+# server/outbox.py
+"""Фоновая доставка сообщений из таблицы outbox в Telegram.
+
+Заказ сохраняется в БД вместе с записью outbox в одной транзакции, HTTP-ответ уходит сразу;
+доставкой занимается OutboxWorker: пачками, с повторами и экспоненциальной задержкой,
+с учётом RetryAfter (flood wait). Гарантия — at-least-once: если процесс упадёт между
+отправкой и сохранением результата пачки, сообщение уйдёт повторно (после CLAIM_LEASE).
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from sqlalchemy import select, update
+
+from server.db import SessionLocal
+from server.models import OutboxMessage, OutboxStatus
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = 20
+POLL_INTERVAL = 5.0  # сек; новые заказы будят воркер сразу через notify()
+MAX_ATTEMPTS = 10
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 600.0
+CLAIM_LEASE = 120.0  # сек: столько взятая пачка скрыта от других воркеров
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def backoff(attempts: int) -> float:
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(0, attempts - 1))
+
+
+class OutboxWorker:
+    def __init__(self, bot: Bot, batch_size: int = BATCH_SIZE, poll_interval: float = POLL_INTERVAL):
+        self.bot = bot
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="outbox-worker")
+
+    def notify(self):
+        """Есть новые сообщения — не ждать следующего опроса."""
+        self._wake.set()
+
+    async def stop(self, timeout: float = 10.0):
+        self._stopping = True
+        self._wake.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                processed = await self.deliver_batch()
+            except Exception:
+                log.exception("outbox batch failed")
+                processed = 0
+            if processed >= self.batch_size:
+                continue  # в очереди есть ещё — без паузы
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def deliver_batch(self) -> int:
+        """Одна пачка готовых к отправке сообщений; возвращает, сколько строк обработано."""
+        batch = await self._claim()
+        for i, msg in enumerate(batch):
+            try:
+                await self.bot.send_message(msg.chat_id, msg.text, disable_web_page_preview=True)
+            except TelegramRetryAfter as e:
+                # flood wait действует на весь бот: откладываем остаток пачки целиком
+                resume = _now() + timedelta(seconds=e.retry_after)
+                for rest in batch[i:]:
+                    rest.next_attempt_at = resume
+                log.warning("outbox: flood wait %ss", e.retry_after)
+                break
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # повтор не поможет: бот заблокирован / чат не найден / кривой текст
+                msg.status = OutboxStatus.FAILED.value
+                msg.attempts += 1
+                msg.last_error = str(e)[:512]
+                log.error("outbox #%s failed permanently: %s", msg.id, e)
+            except Exception as e:
+                msg.attempts += 1
+                msg.last_error = str(e)[:512]
+                if msg.attempts >= MAX_ATTEMPTS:
+                    msg.status = OutboxStatus.FAILED.value
+                    log.error("outbox #%s gave up after %s attempts: %s", msg.id, msg.attempts, e)
+                else:
+                    msg.next_attempt_at = _now() + timedelta(seconds=backoff(msg.attempts))
+                    log.warning("outbox #%s attempt %s failed: %s", msg.id, msg.attempts, e)
+            else:
+                msg.status = OutboxStatus.SENT.value
+                msg.attempts += 1
+                msg.sent_at = _now()
+
+        if batch:
+            await self._save(batch)
+        return len(batch)
+
+    async def _claim(self) -> List[OutboxMessage]:
+        """Короткая транзакция: берём пачку и сдвигаем next_attempt_at на CLAIM_LEASE вперёд.
+        Другие воркеры её не увидят, а блокировки строк и соединение пула не держатся,
+        пока идут вызовы Telegram. Упал посреди отправки — пачка вернётся по истечении аренды."""
+        now = _now()
+        async with SessionLocal() as s:
+            stmt = (
+                select(OutboxMessage)
+                .where(
+                    OutboxMessage.status == OutboxStatus.PENDING.value,
+                    OutboxMessage.next_attempt_at <= now,
+                )
+                .order_by(OutboxMessage.id)
+                .limit(self.batch_size)
+                # несколько воркеров uvicorn не возьмут одни и те же строки (Postgres)
+                .with_for_update(skip_locked=True)
+            )
+            batch = (await s.execute(stmt)).scalars().all()
+            lease = now + timedelta(seconds=CLAIM_LEASE)
+            for msg in batch:
+                msg.next_attempt_at = lease
+            await s.commit()
+        return list(batch)
+
+    async def _save(self, batch: List[OutboxMessage]):
+        async with SessionLocal() as s:
+            await s.execute(
+                update(OutboxMessage),
+                [
+                    {
+                        "id": msg.id,
+                        "status": msg.status,
+                        "attempts": msg.attempts,
+                        "next_attempt_at": msg.next_attempt_at,
+                        "last_error": msg.last_error,
+                        "sent_at": msg.sent_at,
+                    }
+                    for msg in batch
+                ],
+            )
+            await s.commit()
@@ -0,0 +1,127 @@
+# server/search.py
+"""Полнотекстовый поиск по товарам.
+
+Postgres: tsvector с конфигурацией russian (GIN-индекс по выражению) + pg_trgm для опечаток.
+SQLite: FTS5-таблица products_fts, синхронизируемая триггерами с products.
+"""
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import column, func, literal, literal_column, or_, table, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from server.models import Product
+
+MAX_TERMS = 8
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# окончания, которые отрезаем у слов запроса на SQLite (у FTS5 нет русского стеммера):
+# «фары» -> «фар*» находит и «фара», и «фарой»
+_RU_ENDINGS = sorted(
+    [
+        "ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "иях", "ах", "ях",
+        "ов", "ев", "ей", "ой", "ий", "ый", "ая", "яя", "ое", "ее", "ые", "ие",
+        "ом", "ем", "ам", "ям", "ую", "юю", "а", "я", "о", "е", "ы", "и", "у", "ю", "ь",
+    ],
+    key=len,
+    reverse=True,
+)
+_MIN_STEM = 3
+
+# одно и то же выражение в индексе и в запросе — иначе планировщик не возьмёт индекс
+_PG_TSV = "to_tsvector('russian', coalesce(products.title, '') || ' ' || coalesce(products.subtitle, ''))"
+
+_fts = table("products_fts", column("rowid"), column("rank"))
+
+
+def terms(q: Optional[str]) -> List[str]:
+    return [w.lower() for w in _WORD_RE.findall(q or "")][:MAX_TERMS]
+
+
+def _stem(word: str) -> str:
+    for ending in _RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[: -len(ending)]
+    return word
+
+
+def apply_search(stmt, q: str, dialect: str) -> Tuple[object, Optional[object]]:
+    """Добавляет в SELECT по Product условие поиска; возвращает (stmt, выражение релевантности).
+
+    Релевантность None — поиск выродился в подстроку (нет слов или неизвестный диалект)."""
+    words = terms(q)
+    if not words:
+        pattern = f"%{q.strip()}%"
+        return stmt.where(or_(Product.title.ilike(pattern), Product.subtitle.ilike(pattern))), None
+
+    if dialect == "postgresql":
+        tsv = literal_column(_PG_TSV)
+        tsq = func.to_tsquery(literal_column("'russian'"), " & ".join(f"{w}:*" for w in words))
+        ql = " ".join(words)
+        title_l = func.lower(Product.title)
+        stmt = stmt.where(or_(tsv.op("@@")(tsq), literal(ql).op("<%")(title_l)))
+        return stmt, func.ts_rank(tsv, tsq) + func.word_similarity(ql, title_l)
+
+    if dialect == "sqlite":
+        match = " ".join(f'"{_stem(w)}"*' for w in words)
+        stmt = stmt.join(_fts, _fts.c.rowid == Product.id).where(
+            literal_column("products_fts").op("MATCH")(match)
+        )
+        # rank у FTS5 — bm25, чем меньше, тем релевантнее
+        return stmt, -_fts.c.rank
+
+    pattern = f"%{q.strip()}%"
+    return stmt.where(or_(Product.title.ilike(pattern), Product.subtitle.ilike(pattern))), None
+
+
+_SQLITE_DDL = [
+    """
+    CREATE VIRTUAL TABLE products_fts USING fts5(
+        title, subtitle,
+        content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, title, subtitle) VALUES (new.id, new.title, new.subtitle);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, title, subtitle)
+        VALUES ('delete', old.id, old.title, old.subtitle);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF title, subtitle ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, title, subtitle)
+        VALUES ('delete', old.id, old.title, old.subtitle);
+        INSERT INTO products_fts(rowid, title, subtitle) VALUES (new.id, new.title, new.subtitle);
+    END
+    """,
+    "INSERT INTO products_fts(products_fts) VALUES ('rebuild')",
+]
+
+_PG_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_products_search ON products USING GIN ("
+    "to_tsvector('russian', coalesce(title, '') || ' ' || coalesce(subtitle, '')))",
+    "CREATE INDEX IF NOT EXISTS ix_products_title_trgm ON products USING GIN (lower(title) gin_trgm_ops)",
+]
+
+
+async def ensure_search_schema(conn: AsyncConnection):
+    """Создаёт поисковые индексы (идемпотентно). Вызывается после create_all."""
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        for ddl in _PG_DDL:
+            await conn.execute(text(ddl))
+    elif dialect == "sqlite":
+        exists = await conn.scalar(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")
+        )
+        if not exists:
+            for ddl in _SQLITE_DDL:
+                await conn.execute(text(ddl))
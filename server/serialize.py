@@ -0,0 +1,44 @@
+# server/serialize.py
+"""Быстрая сериализация ответов API.
+
+orjson, если установлен (в разы быстрее json и сразу отдаёт bytes); без него — stdlib json
+с тем же результатом. Для выдачи каталога товары кодируются один раз при сборке снимка
+(server/catalog.py), а ответ склеивается из готовых фрагментов.
+"""
+import json
+from typing import Any, Iterable
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # необязательная зависимость
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def to_builtin(model) -> dict:
+    """pydantic-модель -> dict (v2 и v1)."""
+    dump = getattr(model, "model_dump", None)
+    return dump() if dump is not None else model.dict()
+
+
+def encode_model(model) -> bytes:
+    return dumps(to_builtin(model))
+
+
+def json_array(fragments: Iterable[bytes]) -> bytes:
+    """Массив из уже закодированных элементов."""
+    return b"[" + b",".join(fragments) + b"]"
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse на orjson (fallback — json)."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,18 @@
+# server/telegram.py
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from config import settings
+from server.metrics import TelegramMetricsMiddleware
+
+
+def create_bot(token: str) -> Bot:
+    """Bot с собственной aiohttp-сессией: keep-alive соединения к api.telegram.org
+    переиспользуются между запросами, размер пула — TG_POOL_SIZE. Длительность вызовов пишется в метрики.
+    TELEGRAM_API_URL — другой Bot API сервер (свой telegram-bot-api, фейк в тестах)."""
+    kwargs = {"api": TelegramAPIServer.from_base(settings.TELEGRAM_API_URL)} if settings.TELEGRAM_API_URL else {}
+    session = AiohttpSession(limit=settings.TG_POOL_SIZE, **kwargs)
+    session.middleware(TelegramMetricsMiddleware())
+    return Bot(token, session=session, default=DefaultBotProperties(parse_mode="HTML"))
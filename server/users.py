@@ -0,0 +1,33 @@
+# server/users.py
+"""Пользователи магазина: атомарный upsert вместо «проверить, потом вставить»."""
+from typing import Iterable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.db import dialect_insert
+from server.models import User
+
+# строк в одном INSERT (лимит параметров SQLite — 32766)
+CHUNK = 1000
+
+
+def _upsert_stmt(rows, **extra):
+    stmt = dialect_insert(User).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[User.id],
+        set_={"username": stmt.excluded.username, "name": stmt.excluded.name, **extra},
+    )
+
+
+async def upsert_user(s: AsyncSession, user_id: int, username: Optional[str], name: Optional[str]) -> User:
+    """INSERT ... ON CONFLICT DO UPDATE ... RETURNING — один запрос, без гонок при параллельных /start.
+    /start значит, что бот снова не заблокирован, — пользователь возвращается в рассылки."""
+    stmt = _upsert_stmt([{"id": user_id, "username": username, "name": name}], is_blocked=False).returning(User)
+    return (await s.scalars(stmt, execution_options={"populate_existing": True})).one()
+
+
+async def upsert_users(s: AsyncSession, rows: Iterable[dict]):
+    """Пакетный вариант: rows — словари с ключами id, username, name."""
+    rows = list(rows)
+    for i in range(0, len(rows), CHUNK):
+        await s.execute(_upsert_stmt(rows[i:i + CHUNK]))
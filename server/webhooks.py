@@ -0,0 +1,116 @@
+# server/webhooks.py
+"""Webhook-режим ботов (BOT_MODE=webhook): апдейты Telegram принимает процесс API.
+
+Telegram шлёт POST /tg/<имя> (shop — бот магазина, admin — админ-бот) с заголовком
+X-Telegram-Bot-Api-Secret-Token. Апдейт уходит в Dispatcher своего бота фоновой задачей:
+Telegram сразу получает 200, а обработка идёт конкурентно — как и при polling.
+Вебхуки регистрирует каждый воркер при старте (setWebhook идемпотентен).
+
+on_startup админ-бота тоже вызывает каждый воркер uvicorn: у каждого свой BroadcastWorker
+и своя сессия бота магазина. Это безопасно — рассылку берёт в работу только владелец
+аренды (broadcasts.locked_until, server/broadcast.py), остальные воркеры её не трогают.
+
+Для локальной разработки остаётся polling (BOT_MODE=polling): python bot.py / admin_bot.py.
+FSM админ-бота хранится в памяти процесса — при нескольких воркерах uvicorn нужен
+общий storage (Redis), иначе шаги диалога разъедутся по воркерам.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, Set
+from urllib.parse import urljoin
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import settings
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+STOP_TIMEOUT = 10.0  # сек на дообработку апдейтов при остановке
+
+
+@dataclass
+class Hook:
+    name: str
+    bot: Bot
+    dp: Dispatcher
+    secret: str
+    on_startup: Optional[Callable[[], Awaitable[None]]] = None
+
+    def check(self, secret: Optional[str]) -> bool:
+        return hmac.compare_digest((secret or "").encode(), self.secret.encode())
+
+
+def webhook_secret(token: str) -> str:
+    """Явный TG_WEBHOOK_SECRET или производный от токена (одинаковый во всех воркерах)."""
+    if settings.TG_WEBHOOK_SECRET:
+        return settings.TG_WEBHOOK_SECRET
+    return hashlib.sha256(f"tg-webhook:{token}".encode()).hexdigest()
+
+
+def webhook_url(name: str) -> str:
+    base = settings.TG_WEBHOOK_BASE or settings.WEBAPP_URL
+    if not base:
+        raise RuntimeError("Для BOT_MODE=webhook нужен TG_WEBHOOK_BASE (или WEBAPP_URL)")
+    return urljoin(base, f"/tg/{name}")
+
+
+def _load_hooks() -> Dict[str, Hook]:
+    # модули ботов импортируются только здесь: при polling серверу они не нужны
+    hooks = {}
+    if settings.BOT_TOKEN:
+        from bot.bot import bot, dp
+
+        hooks["shop"] = Hook("shop", bot, dp, webhook_secret(settings.BOT_TOKEN))
+    if settings.ADMIN_BOT_TOKEN:
+        from admin_bot.admin_bot import bot, dp, on_startup
+
+        hooks["admin"] = Hook("admin", bot, dp, webhook_secret(settings.ADMIN_BOT_TOKEN), on_startup)
+    return hooks
+
+
+class Webhooks:
+    def __init__(self):
+        self.hooks: Dict[str, Hook] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def start(self):
+        self.hooks = _load_hooks()
+        for hook in self.hooks.values():
+            if hook.on_startup is not None:
+                await hook.on_startup()
+            await hook.dp.emit_startup(bot=hook.bot)
+            url = webhook_url(hook.name)
+            await hook.bot.set_webhook(
+                url,
+                secret_token=hook.secret,
+                allowed_updates=hook.dp.resolve_used_update_types(),
+            )
+            log.info("webhook %s -> %s", hook.name, url)
+
+    def get(self, name: str) -> Optional[Hook]:
+        return self.hooks.get(name)
+
+    def feed(self, hook: Hook, data: dict):
+        update = Update.model_validate(data, context={"bot": hook.bot})
+        task = asyncio.create_task(self._process(hook, update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, hook: Hook, update: Update):
+        try:
+            await hook.dp.feed_update(hook.bot, update)
+        except Exception:
+            log.exception("webhook %s: update %s failed", hook.name, update.update_id)
+
+    async def stop(self):
+        # вебхук не снимаем: остальные воркеры (и следующий деплой) продолжают принимать апдейты
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=STOP_TIMEOUT)
+        for hook in self.hooks.values():
+            await hook.dp.emit_shutdown(bot=hook.bot)
+            await hook.bot.session.close()